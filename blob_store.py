@@ -0,0 +1,168 @@
+#   Copyright 2023 Alexandre Grigoriev
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+### This module keeps the file contents of blobs, within a memory budget.
+# The contents are keyed by their data SHA1, and the same contents are only kept once.
+# When the contents in memory exceed the budget, the least recently used contents are evicted.
+# The contents which can be read again from the history source are just dropped.
+# Other contents are written to a temporary spill file, which is mapped to memory to read them back.
+
+import mmap
+import tempfile
+import threading
+import weakref
+from collections import OrderedDict
+
+TOTAL_CONTENTS_SPILLED = 0
+TOTAL_BYTES_SPILLED = 0
+
+### stored_content is the data source of blobs with the same contents.
+# When called, it returns the contents from the store.
+# It lives as long as any blob refers to it, or its contents are cached in memory
+class stored_content:
+	__slots__ = ('store', 'data_sha1', 'data', 'source', 'offset', 'length', '__weakref__')
+
+	def __init__(self, store, data_sha1, source):
+		self.store = store
+		self.data_sha1 = data_sha1
+		# The contents, while kept in memory
+		self.data = None
+		# Callable to read the contents again from the history source, or None
+		self.source = source
+		# Location of the contents in the spill file, once written there
+		self.offset = None
+		self.length = 0
+		return
+
+	def __call__(self):
+		return self.store.get(self)
+
+	### release() drops the contents from memory, if they can be loaded again
+	def release(self):
+		self.store.release(self)
+		return
+
+class content_store:
+	def __init__(self, memory_size=None):
+		# Maximum total length of contents kept in memory, or None for no limit
+		self.memory_size = memory_size
+		self.memory_used = 0
+		# stored_content instances, keyed by data SHA1.
+		# The references are weak, so the contents no blob refers to any more are dropped
+		self.contents = weakref.WeakValueDictionary()
+		# Contents kept in memory, in least recently used order
+		self.cached = OrderedDict()
+		self.spill_file = None
+		self.spill_size = 0
+		self.spill_map = None
+		# The contents can be released by Git hashing threads
+		self.lock = threading.Lock()
+		return
+
+	### add() returns stored_content for the data SHA1.
+	# 'data' is the contents just read, or None if they're not loaded.
+	# 'source' is a callable to read them again, or None
+	def add(self, data_sha1, data, source):
+		with self.lock:
+			content = self.contents.get(data_sha1)
+			if content is None:
+				content = stored_content(self, data_sha1, source)
+				self.contents[data_sha1] = content
+			elif content.source is None:
+				content.source = source
+
+			if data is not None and content.data is None:
+				self.cache(content, data)
+		return content
+
+	def get(self, content):
+		with self.lock:
+			data = content.data
+			if data is not None:
+				self.cached.move_to_end(content)
+				return data
+
+			if content.offset is not None:
+				data = self.read_spilled(content)
+			else:
+				source = content.source
+
+		if data is None:
+			# The history source is read without holding the lock
+			data = source()
+
+		with self.lock:
+			if content.data is None:
+				self.cache(content, data)
+		return data
+
+	def release(self, content):
+		with self.lock:
+			if content.data is not None and (content.source is not None or content.offset is not None):
+				self.uncache(content)
+		return
+
+	def cache(self, content, data):
+		content.data = data
+		self.cached[content] = None
+		self.memory_used += len(data)
+
+		if self.memory_size is None:
+			return
+
+		while self.memory_used > self.memory_size and self.cached:
+			content, _ = self.cached.popitem(last=False)
+			if content.source is None and content.offset is None:
+				self.spill(content)
+			self.memory_used -= len(content.data)
+			content.data = None
+			continue
+		return
+
+	def uncache(self, content):
+		del self.cached[content]
+		self.memory_used -= len(content.data)
+		content.data = None
+		return
+
+	def spill(self, content):
+		global TOTAL_CONTENTS_SPILLED, TOTAL_BYTES_SPILLED
+		if self.spill_file is None:
+			self.spill_file = tempfile.TemporaryFile(prefix='hg-to-git-', suffix='.spill')
+		data = content.data
+		self.spill_file.write(data)
+		content.offset = self.spill_size
+		content.length = len(data)
+		self.spill_size += len(data)
+
+		TOTAL_CONTENTS_SPILLED += 1
+		TOTAL_BYTES_SPILLED += len(data)
+		return
+
+	def read_spilled(self, content):
+		if not content.length:
+			return b''
+		end = content.offset + content.length
+		if self.spill_map is None or end > len(self.spill_map):
+			# Map the file again, to cover the contents written after it was mapped
+			self.spill_file.flush()
+			if self.spill_map is not None:
+				self.spill_map.close()
+			self.spill_map = mmap.mmap(self.spill_file.fileno(), 0, access=mmap.ACCESS_READ)
+		return self.spill_map[content.offset:end]
+
+def print_stats(fd):
+	if TOTAL_CONTENTS_SPILLED:
+		print("File contents spilled to disk: %d, %d MiB" % (TOTAL_CONTENTS_SPILLED, TOTAL_BYTES_SPILLED//0x100000), file=fd)
+	return
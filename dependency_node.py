@@ -14,6 +14,9 @@
 
 import os
 import queue
+import threading
+import asyncio
+import inspect
 import concurrent.futures
 
 ## This object manages chains of dependencies.
@@ -217,6 +220,57 @@ class async_executor(dependency_node):
 			to_execute -= 1
 		return True
 
+## async_loop runs a single asyncio event loop in a background thread.
+# Coroutines submitted to the loop return concurrent.futures.Future objects,
+# the same as functions submitted to a ThreadPoolExecutor.
+# The loop owns all short-lived Git child processes, thus the number
+# of in-flight Git operations is not limited by the number of threads.
+class async_loop:
+	_loop = None
+	_thread = None
+	_lock = threading.Lock()
+
+	def get_loop():
+		with async_loop._lock:
+			if async_loop._loop is None:
+				loop = asyncio.new_event_loop()
+				thread = threading.Thread(target=loop.run_forever, name='async_loop', daemon=True)
+				thread.start()
+				async_loop._loop = loop
+				async_loop._thread = thread
+			return async_loop._loop
+
+	def submit(coro):
+		return asyncio.run_coroutine_threadsafe(coro, async_loop.get_loop())
+
+	### call() runs the coroutine in the loop and waits for its result.
+	# It must not be called from a coroutine, as it would block the loop
+	def call(coro):
+		assert(threading.current_thread() is not async_loop._thread)
+		return async_loop.submit(coro).result()
+
+	async def cancel_all():
+		tasks = asyncio.all_tasks()
+		tasks.discard(asyncio.current_task())
+		for task in tasks:
+			task.cancel()
+		await asyncio.gather(*tasks, return_exceptions=True)
+		return
+
+	def shutdown():
+		with async_loop._lock:
+			loop = async_loop._loop
+			if loop is None:
+				return
+			# Cancel the coroutines still running, to terminate their child processes
+			asyncio.run_coroutine_threadsafe(async_loop.cancel_all(), loop).result()
+			loop.call_soon_threadsafe(loop.stop)
+			async_loop._thread.join()
+			loop.close()
+			async_loop._loop = None
+			async_loop._thread = None
+		return
+
 class async_workitem(dependency_node):
 	_futures_executor = None
 
@@ -251,7 +305,11 @@ class async_workitem(dependency_node):
 		if not self.async_func:
 			return self.async_completion_callback(None)
 		assert(self.future is None)
-		self.future = self.futures_executor.submit(self.async_func, *self.async_args, **self.async_kwargs)
+		if inspect.iscoroutinefunction(self.async_func):
+			# Coroutines run in the common event loop, instead of occupying a thread
+			self.future = async_loop.submit(self.async_func(*self.async_args, **self.async_kwargs))
+		else:
+			self.future = self.futures_executor.submit(self.async_func, *self.async_args, **self.async_kwargs)
 		self.async_func = None
 		self.future.add_done_callback(self.async_completion_callback)
 		return
@@ -0,0 +1,242 @@
+#   Copyright 2023 Alexandre Grigoriev
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+### This module emulates Git check-in conversion of blobs, done by "git hash-object --path=<path>".
+# Only 'text' and 'eol' attributes (and 'binary' macro) and core.autocrlf setting are supported.
+# If a path is subject to any other conversion (filter drivers, ident, working-tree-encoding),
+# or .gitattributes file uses a syntax not supported here, the conversion cannot be emulated,
+# and the blob needs to be hashed by Git.
+
+import re
+from pathlib import Path
+
+class Exception_unsupported_attributes(Exception):
+	pass
+
+# Attributes which require conversions not emulated by this module
+UNSUPPORTED_ATTRIBUTES = ('filter', 'ident', 'working-tree-encoding', 'crlf')
+
+BUILTIN_MACROS = {
+	'binary' : (('diff', False), ('merge', False), ('text', False)),
+}
+
+def wildmatch_to_regex(pattern):
+	regex = ''
+	i = 0
+	length = len(pattern)
+	while i < length:
+		c = pattern[i]
+		if c == '*':
+			if pattern.startswith('**', i):
+				at_start = i == 0 or pattern[i-1] == '/'
+				at_end = i + 2 == length or pattern[i+2] == '/'
+				if at_start and at_end:
+					if i + 2 == length:
+						# trailing '/**' matches everything inside
+						regex += '.*'
+						i += 2
+					else:
+						# '**/' matches zero or more directories
+						regex += '(?:.*/)?'
+						i += 3
+					continue
+				i += 2
+			else:
+				i += 1
+			regex += '[^/]*'
+			continue
+		if c == '?':
+			regex += '[^/]'
+		elif c == '[':
+			end = pattern.find(']', i + 2)
+			if end < 0:
+				raise Exception_unsupported_attributes(pattern)
+			char_class = pattern[i+1:end]
+			if '[' in char_class or '\\' in char_class:
+				raise Exception_unsupported_attributes(pattern)
+			if char_class[0] in '!^':
+				regex += '[^/' + char_class[1:] + ']'
+			else:
+				regex += '[' + char_class + ']'
+			i = end
+		elif c == '\\':
+			i += 1
+			if i == length:
+				raise Exception_unsupported_attributes(pattern)
+			regex += re.escape(pattern[i])
+		else:
+			regex += re.escape(c)
+		i += 1
+	return re.compile(regex)
+
+### attributes_file keeps patterns and attribute assignments of a single .gitattributes file
+class attributes_file:
+	def __init__(self, data:bytes, directory='', allow_macros=False):
+		# directory is relative to the root, with trailing slash, or empty for the root
+		self.directory = directory
+		self.lines = []
+		self.macros = {}
+
+		for line in data.decode('utf-8').splitlines():
+			line = line.strip()
+			if not line or line.startswith('#'):
+				continue
+			if line.startswith('"'):
+				raise Exception_unsupported_attributes(line)
+
+			pattern, *attrs = line.split()
+			assignments = self.parse_assignments(attrs)
+
+			if pattern.startswith('[attr]'):
+				if not allow_macros:
+					# Macros are ignored in subdirectories
+					continue
+				self.macros[pattern[6:]] = assignments
+				continue
+			if pattern.startswith('!'):
+				# Negative patterns are ignored by Git
+				continue
+			if pattern.endswith('/'):
+				# Directory patterns don't apply to files
+				continue
+
+			if '/' in pattern:
+				match_basename = False
+				pattern = pattern.removeprefix('/')
+			else:
+				match_basename = True
+			self.lines.append((wildmatch_to_regex(pattern), match_basename, assignments))
+			continue
+		return
+
+	def parse_assignments(self, attrs):
+		assignments = []
+		for attr in attrs:
+			if attr.startswith('-'):
+				assignments.append((attr[1:], False))
+			elif attr.startswith('!'):
+				assignments.append((attr[1:], None))
+			else:
+				key, eq, value = attr.partition('=')
+				assignments.append((key, value if eq else True))
+		return assignments
+
+	### Apply assignments from matching lines to attrs dictionary
+	def apply(self, path, attrs, macros):
+		if not path.startswith(self.directory):
+			return
+		path = path[len(self.directory):]
+		basename = path.rpartition('/')[2]
+		for regex, match_basename, assignments in self.lines:
+			if not regex.fullmatch(basename if match_basename else path):
+				continue
+			self.assign(assignments, attrs, macros)
+		return
+
+	def assign(self, assignments, attrs, macros):
+		for key, value in assignments:
+			macro = macros.get(key)
+			if macro is not None and value is True:
+				self.assign(macro, attrs, {})
+			attrs[key] = value
+		return
+
+### attributes_stack keeps all attribute files, which apply to a work directory
+class attributes_stack:
+	def __init__(self, work_dir:Path=None, global_files=(), info_files=()):
+		# The list is in the order of increasing precedence
+		self.files = []
+		self.macros = dict(BUILTIN_MACROS)
+
+		for file in global_files:
+			self.add_file(Path(file).read_bytes(), allow_macros=True)
+
+		if work_dir is not None:
+			attr_files = []
+			for attr_file in Path(work_dir).rglob('.gitattributes'):
+				directory = attr_file.parent.relative_to(work_dir).as_posix()
+				if directory == '.':
+					directory = ''
+				else:
+					directory += '/'
+				attr_files.append((directory.count('/'), directory, attr_file))
+			# Deeper directories take precedence
+			attr_files.sort()
+			for depth, directory, attr_file in attr_files:
+				self.add_file(attr_file.read_bytes(), directory, allow_macros=not directory)
+
+		for file in info_files:
+			self.add_file(Path(file).read_bytes(), allow_macros=True)
+		return
+
+	def add_file(self, data, directory='', allow_macros=False):
+		file = attributes_file(data, directory, allow_macros)
+		self.macros.update(file.macros)
+		self.files.append(file)
+		return
+
+	def get_attributes(self, path):
+		attrs = {}
+		for file in self.files:
+			file.apply(path, attrs, self.macros)
+		return attrs
+
+def is_binary(data:bytes):
+	# Same heuristic as Git convert_is_binary()
+	if b'\0' in data:
+		return True
+	if data.count(b'\r') != data.count(b'\r\n'):
+		# Lone CR
+		return True
+	nonprintable = sum(map(data.count, NONPRINTABLE_CHARS))
+	# CR and LF are counted neither as printable, nor as non-printable
+	printable = len(data) - nonprintable - data.count(b'\r') - data.count(b'\n')
+	if data.endswith(b'\x1a'):
+		# Trailing ^Z is not counted as non-printable
+		nonprintable -= 1
+	return (printable >> 7) < nonprintable
+
+NONPRINTABLE_CHARS = [bytes((c,)) for c in (*range(1, 8), 0x0b, *range(0x0e, 0x1b), *range(0x1c, 0x20), 0x7f)]
+
+CONVERT_NONE = 0
+CONVERT_TEXT = 1
+CONVERT_AUTO = 2
+
+### get_crlf_action() returns the check-in conversion action for the given attributes dictionary
+def get_crlf_action(attrs, autocrlf=False):
+	for key in UNSUPPORTED_ATTRIBUTES:
+		value = attrs.get(key)
+		if value is not None and value is not False:
+			raise Exception_unsupported_attributes(key)
+
+	text = attrs.get('text')
+	if text is False:
+		return CONVERT_NONE
+	if text is True or text == 'input':
+		return CONVERT_TEXT
+	if text == 'auto':
+		return CONVERT_AUTO
+	if attrs.get('eol') in ('lf', 'crlf'):
+		return CONVERT_TEXT
+	if autocrlf:
+		return CONVERT_AUTO
+	return CONVERT_NONE
+
+### convert_to_git() converts the data as "git hash-object --path" would do
+def convert_to_git(data:bytes, crlf_action):
+	if crlf_action == CONVERT_NONE or b'\r\n' not in data:
+		return data
+	if crlf_action == CONVERT_AUTO and is_binary(data):
+		return data
+	return data.replace(b'\r\n', b'\n')
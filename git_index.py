@@ -0,0 +1,261 @@
+#   Copyright 2023 Alexandre Grigoriev
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+import os
+import struct
+import hashlib
+import itertools
+
+TREE_MODE = 0o40000
+
+### index_tree is an in-memory replacement of a Git index file.
+# It keeps the staged paths as a hierarchy of directories.
+# Each directory keeps a dictionary of its entries, keyed by name (str).
+# A file entry is a tuple of (mode, Git SHA1 as 40 chars hex string).
+# A directory entry is a nested index_tree.
+# The trees are never modified after they have been published (returned from apply()),
+# thus a snapshot of the staged tree can be kept for each revision,
+# and unchanged subdirectories are shared between snapshots.
+# The Git tree SHA1 and the number of files are calculated on demand and memoized in each directory.
+# Serialized Git index file entries are not kept, see write_index_file()
+class index_tree:
+	__slots__ = ('entries', 'sha1', 'num_files', '__weakref__')
+
+	def __init__(self, src=None):
+		if src is not None:
+			self.entries = src.entries.copy()
+		else:
+			self.entries = {}
+		self.sha1 = None
+		self.num_files = None
+		return
+
+	def __len__(self):
+		return len(self.entries)
+
+	def is_empty(self):
+		return not self.entries
+
+	### apply() makes a new snapshot by applying the stagelist to this tree.
+	# The stagelist items have .path, .obj, and .mode attributes.
+	# If .obj is None, the path is deleted, as done by "git update-index --force-remove".
+	# Each directory along the modified paths is copied only once
+	def apply(self, stagelist):
+		new_tree = index_tree(self)
+		unshared = {id(new_tree)}
+		for item in stagelist:
+			if item.obj is None:
+				new_tree.delete_path(item.path, unshared)
+			else:
+				new_tree.set_path(item.path, (item.mode, item.obj.get_git_sha1()), unshared)
+			continue
+		return new_tree
+
+	def get_unshared_subtree(self, name, unshared):
+		subtree = self.entries.get(name)
+		if type(subtree) is not index_tree:
+			subtree = index_tree()
+		elif id(subtree) in unshared:
+			return subtree
+		else:
+			subtree = index_tree(subtree)
+		unshared.add(id(subtree))
+		self.entries[name] = subtree
+		return subtree
+
+	def set_path(self, path, entry, unshared):
+		t = self
+		split = path.split('/')
+		for name in split[:-1]:
+			t.sha1 = None
+			t.num_files = None
+			t = t.get_unshared_subtree(name, unshared)
+		t.sha1 = None
+		t.num_files = None
+		t.entries[split[-1]] = entry
+		return
+
+	def delete_path(self, path, unshared):
+		name, sep, subpath = path.partition('/')
+		entry = self.entries.get(name)
+		if entry is None:
+			return False
+
+		if not sep:
+			self.entries.pop(name)
+		elif type(entry) is not index_tree:
+			return False
+		else:
+			subtree = self.get_unshared_subtree(name, unshared)
+			if not subtree.delete_path(subpath, unshared):
+				return False
+			if not subtree.entries:
+				# Git index doesn't keep empty directories
+				self.entries.pop(name)
+		self.sha1 = None
+		self.num_files = None
+		return True
+
+	### sorted_entries() returns the list of (name, mode, sha1) tuples,
+	# sorted in Git tree order: directory names are compared as if they had a trailing slash
+	def sorted_entries(self):
+		items = []
+		for name, entry in self.entries.items():
+			if type(entry) is index_tree:
+				items.append((name + '/', name, TREE_MODE, entry.get_sha1()))
+			else:
+				items.append((name, name, *entry))
+		items.sort()
+		return [t[1:] for t in items]
+
+	### Returns Git tree object data, without 'tree <length>\0' header
+	def make_tree_object(self):
+		return b''.join(b'%o %s\0%s' % (mode, name.encode(), bytes.fromhex(sha1))
+					for name, mode, sha1 in self.sorted_entries())
+
+	def get_sha1(self):
+		if self.sha1 is None:
+			data = self.make_tree_object()
+			h = hashlib.sha1(b'tree %d\0' % len(data))
+			h.update(data)
+			self.sha1 = h.hexdigest()
+		return self.sha1
+
+	### get_num_files() returns number of files (index entries) under this directory
+	def get_num_files(self):
+		if self.num_files is None:
+			num_files = 0
+			for entry in self.entries.values():
+				if type(entry) is index_tree:
+					num_files += entry.get_num_files()
+				else:
+					num_files += 1
+			self.num_files = num_files
+		return self.num_files
+
+	### iter_index_entries() generator returns serialized Git index entries of all files under this directory,
+	# in the index order. Each chunk has the entries of consecutive files of a single directory.
+	# prefix is the path of this directory with a trailing slash, or an empty string for the root.
+	# The entries are not memoized, because they would take more memory than the tree itself
+	def iter_index_entries(self, prefix):
+		entries = []
+		for name, mode, sha1 in self.sorted_entries():
+			if mode == TREE_MODE:
+				if entries:
+					yield b''.join(entries)
+					entries = []
+				yield from self.entries[name].iter_index_entries(prefix + name + '/')
+				continue
+
+			path = (prefix + name).encode()
+			# Stat data is all zeros, because there's no work tree
+			entries.append(INDEX_ENTRY_STRUCT.pack(0, 0, 0, 0, 0, 0, mode, 0, 0, 0,
+						bytes.fromhex(sha1), min(len(path), 0xFFF)))
+			entries.append(path)
+			# The entry is padded with 1 to 8 NUL characters to a multiple of 8 bytes
+			entries.append(b'\0' * (8 - (INDEX_ENTRY_STRUCT.size + len(path)) % 8))
+			continue
+
+		if entries:
+			yield b''.join(entries)
+		return
+
+	### get_tree_records() returns serialized cache tree ('TREE' extension) records
+	# for this directory and its subdirectories.
+	# dirname is the name of this directory, or an empty string for the root.
+	# The tree SHA1 and number of files are memoized, thus only the modified directories are hashed again
+	def get_tree_records(self, dirname=b''):
+		subtrees = []
+		for name, entry in self.entries.items():
+			if type(entry) is index_tree:
+				name = name.encode()
+				subtrees.append((len(name), name, entry))
+
+		# The cache tree record has the directory name (empty for the root),
+		# the number of index entries and subdirectories, and the tree SHA1.
+		# It's followed by records of the subdirectories, which Git orders by name length first
+		subtrees.sort(key=lambda t: t[:2])
+		return b''.join((b'%s\0%d %d\n%s' % (dirname, self.get_num_files(), len(subtrees), bytes.fromhex(self.get_sha1())),
+					*(subtree.get_tree_records(name) for _, name, subtree in subtrees)))
+
+	def __iter__(self, prefix=''):
+		# The iterator returns tuples of (path, mode, sha1) for all files in the tree
+		for name, entry in self.entries.items():
+			if type(entry) is index_tree:
+				yield from entry.__iter__(prefix + name + '/')
+			else:
+				yield (prefix + name, *entry)
+		return
+
+	### compare() function returns changes to turn tree1 into tree2,
+	# as a sequence of tuples:
+	# (path, None, None) to delete a path (file or whole directory),
+	# (path, mode, sha1) to add or replace a file
+	# Deletions of a path come before additions for the same name
+	def compare(tree1, tree2, prefix=''):
+		if tree1 is tree2:
+			return
+		if tree1 is None:
+			tree1 = index_tree()
+		if tree2 is None:
+			tree2 = index_tree()
+
+		if tree1.sha1 is not None and tree1.sha1 == tree2.sha1:
+			return
+
+		entries2 = tree2.entries
+		for name, entry1 in tree1.entries.items():
+			entry2 = entries2.get(name)
+			if entry2 is None:
+				yield (prefix + name, None, None)
+			elif (type(entry1) is index_tree) != (type(entry2) is index_tree):
+				yield (prefix + name, None, None)
+
+		for name, entry2 in entries2.items():
+			entry1 = tree1.entries.get(name)
+			if entry1 is entry2:
+				continue
+			if type(entry2) is index_tree:
+				if type(entry1) is not index_tree:
+					entry1 = None
+				yield from index_tree.compare(entry1, entry2, prefix + name + '/')
+			elif entry1 != entry2:
+				yield (prefix + name, *entry2)
+			continue
+		return
+
+EMPTY_INDEX_TREE = index_tree()
+
+# Index entry: ctime, ctime nsec, mtime, mtime nsec, dev, ino, mode, uid, gid, size, SHA1, flags
+INDEX_ENTRY_STRUCT = struct.Struct('>10I20sH')
+
+### write_index_file() writes Git index file (version 2) for the tree snapshot,
+# which is then the same as produced by "git read-tree <tree>",
+# with a fully valid cache tree extension.
+# The file is written under a temporary name first, and then renamed
+def write_index_file(tree:index_tree, index_file):
+	tree_records = tree.get_tree_records()
+
+	h = hashlib.sha1()
+	tmp_file = str(index_file) + '.lock'
+	with open(tmp_file, 'wb') as fd:
+		# The entries are written as they are serialized, without making the whole file in memory
+		for data in itertools.chain((b'DIRC', struct.pack('>II', 2, tree.get_num_files())),
+				tree.iter_index_entries(''),
+				(b'TREE', struct.pack('>I', len(tree_records)), tree_records)):
+			h.update(data)
+			fd.write(data)
+		fd.write(h.digest())
+	os.replace(tmp_file, index_file)
+	return
@@ -1,37 +1,621 @@
 import os
 import io
 import sys
+import re
 import subprocess
+import threading
+import hashlib
+import weakref
+import datetime
+import shutil
+import zlib
+import tempfile
+from collections import OrderedDict
 from pathlib import Path
-import concurrent.futures
+import asyncio
 from inspect import isgenerator
 
+from git_index import index_tree
+from dependency_node import async_loop
+import git_attributes
+
+NULL_SHA1 = '0000000000000000000000000000000000000000'
+
+### make_git_object_sha1() returns Git object ID (40 chars hex string) of the given object data
+def make_git_object_sha1(obj_type:bytes, data:bytes):
+	h = hashlib.sha1(b'%s %d\0' % (obj_type, len(data)))
+	h.update(data)
+	return h.hexdigest()
+
+### Git strips these characters from the beginning and end of names and emails in identity lines
+def is_ident_crud(c):
+	return c <= ' ' or c in ',:;<>"\\\''
+
+### strip_ident_crud() converts a name or email the same way as Git does
+# when it makes an identity line for a commit or a tag
+def strip_ident_crud(s):
+	begin = 0
+	end = len(s)
+	while begin < end and is_ident_crud(s[begin]):
+		begin += 1
+	while end > begin and is_ident_crud(s[end-1]):
+		end -= 1
+	return re.sub('[\n<>]', '', s[begin:end])
+
+### parse_config_bool() interprets a Git config value as boolean, the same way as Git does.
+# None stands for a key without a value, which means true.
+# An empty string and unrecognized values are false
+def parse_config_bool(value):
+	if value is None:
+		return True
+	value = value.lower()
+	if value in ('true', 'yes', 'on'):
+		return True
+	# An integer, with optional unit suffix
+	try:
+		return int(value.rstrip('kmg'), 0) != 0
+	except ValueError:
+		return False
+
+### format_git_date() converts a date string, as passed in GIT_AUTHOR_DATE,
+# to Git raw date format: "<seconds since epoch> <+hhmm>"
+def format_git_date(date):
+	if not date:
+		dt = datetime.datetime.now().astimezone()
+	else:
+		dt = datetime.datetime.fromisoformat(str(date))
+		if dt.tzinfo is None:
+			dt = dt.astimezone()
+
+	offset = int(dt.utcoffset().total_seconds()) // 60
+	sign = '+'
+	if offset < 0:
+		sign = '-'
+		offset = -offset
+	return '%d %s%02d%02d' % (int(dt.timestamp()), sign, offset // 60, offset % 60)
+
+def format_ident(name, email, date):
+	return '%s <%s> %s' % (strip_ident_crud(name), strip_ident_crud(email), format_git_date(date))
+
+### cleanup_message() does the same as "git stripspace --strip-comments":
+# Trailing whitespaces are trimmed, comment lines are dropped,
+# consecutive empty lines are collapsed into one,
+# empty lines at the beginning and end are dropped
+def cleanup_message(message, comment_char='#'):
+	lines = []
+	empty_lines = 0
+	for line in message.split('\n'):
+		if comment_char and line.startswith(comment_char):
+			continue
+		line = line.rstrip(' \t\r\v\f')
+		if not line:
+			empty_lines += 1
+			continue
+		if empty_lines and lines:
+			lines.append('')
+		empty_lines = 0
+		lines.append(line)
+	return ''.join(line + '\n' for line in lines)
+
+### Makes the tag message from a list of paragraphs, as "git tag -m <paragraph>..." would do
+def make_tag_message(message : list):
+	buf = ''
+	for msg in message:
+		if buf:
+			buf += '\n'
+		buf += msg
+		if not buf.endswith('\n'):
+			buf += '\n'
+	return cleanup_message(buf)
+
+def quote_fast_import_path(path : str):
+	path = path.encode('utf-8')
+	if not path.startswith(b'"') and b'\n' not in path:
+		return path
+	return b'"%s"' % path.replace(b'\\', b'\\\\').replace(b'"', b'\\"').replace(b'\n', b'\\n')
+
+### read_packed_refs() reads packed-refs file.
+# Returns a tuple of: list of traits from the header line (as bytes),
+# and a dictionary of (sha1, peeled sha1 or None) tuples, keyed by refname
+def read_packed_refs(path : Path):
+	# The traits written by Git for a new file
+	traits = [b'peeled', b'fully-peeled', b'sorted']
+	packed_refs = {}
+	try:
+		fd = open(path, 'rb')
+	except FileNotFoundError:
+		return traits, packed_refs
+
+	with fd:
+		# A file without the header line has no traits
+		traits = []
+		ref = None
+		for line in fd:
+			line = line.rstrip(b'\n')
+			if line.startswith(b'# pack-refs with:'):
+				traits = line.removeprefix(b'# pack-refs with:').split()
+			elif line.startswith(b'#'):
+				continue
+			elif line.startswith(b'^'):
+				if ref is not None:
+					packed_refs[ref] = (packed_refs[ref][0], line[1:].decode())
+			elif line:
+				sha1, _, ref = line.decode('utf-8').partition(' ')
+				packed_refs[ref] = (sha1, None)
+			continue
+
+	if b'sorted' not in traits:
+		# The refs will be written sorted
+		traits.append(b'sorted')
+	return traits, packed_refs
+
+### fast_import runs a single long-lived "git fast-import" process.
+# Blobs, commits and tags are streamed to it.
+# Commits are made with marks, and their SHA1 is read back by "get-mark" command.
+# The commit trees are passed as in-memory index_tree, and only the difference
+# from the first parent's tree is sent as filemodify/filedelete commands.
+class fast_import:
+	# All commits are made on this temporary ref. It's deleted at the end.
+	REFNAME = 'refs/hg-to-git/fast-import'
+
+	def __init__(self, repo_path):
+		self.process = subprocess.Popen(["git", "fast-import", "--quiet", "--force", "--done"],
+					stdin=subprocess.PIPE, stdout=subprocess.PIPE, cwd=repo_path)
+		self.pipe = self.process.stdin
+		self.lock = threading.Lock()
+		self.last_mark = 0
+		# Marks of commits made by this process, keyed by their SHA1
+		self.commit_marks = {}
+		# Trees of the commits are needed to make the list of changes for the child commits.
+		# The index_tree objects are kept alive by project_branch_rev objects
+		self.commit_trees = weakref.WeakValueDictionary()
+		self.blobs_written = set()
+		return
+
+	def new_mark(self):
+		self.last_mark += 1
+		return self.last_mark
+
+	# Must be called under the lock
+	def read_response(self):
+		self.pipe.flush()
+		return self.process.stdout.readline().decode().rstrip('\n')
+
+	def get_dataref(self, sha1):
+		mark = self.commit_marks.get(sha1)
+		if mark is not None:
+			return b':%d' % mark
+		return sha1.encode()
+
+	def write_data(self, data:bytes):
+		self.pipe.write(b'data %d\n' % len(data))
+		self.pipe.write(data)
+		self.pipe.write(b'\n')
+		return
+
+	### blob() function writes a blob as-is, without any conversion.
+	# Git SHA1 of the blob is calculated here
+	def blob(self, data, sha1=None):
+		if sha1 is None:
+			sha1 = make_git_object_sha1(b'blob', data)
+		digest = bytes.fromhex(sha1)
+
+		with self.lock:
+			if digest not in self.blobs_written:
+				self.blobs_written.add(digest)
+				self.pipe.write(b'blob\n')
+				self.write_data(data)
+		return sha1
+
+	def commit(self, tree:index_tree, parents, message:bytes, author, committer):
+		with self.lock:
+			mark = self.new_mark()
+			pipe = self.pipe
+			if not parents:
+				# Reset the branch to make a root commit
+				pipe.write(b'reset %s\n\n' % self.REFNAME.encode())
+			pipe.write(b'commit %s\nmark :%d\n' % (self.REFNAME.encode(), mark))
+			pipe.write(b'author %s\ncommitter %s\n' % (author.encode('utf-8'), committer.encode('utf-8')))
+			self.write_data(message)
+
+			if parents:
+				pipe.write(b'from %s\n' % self.get_dataref(parents[0]))
+				for parent in parents[1:]:
+					pipe.write(b'merge %s\n' % self.get_dataref(parent))
+				parent_tree = self.commit_trees.get(parents[0])
+				if parent_tree is None:
+					# The parent commit has not been made by this process
+					pipe.write(b'deleteall\n')
+			else:
+				parent_tree = None
+
+			for path, mode, sha1 in index_tree.compare(parent_tree, tree):
+				if mode is None:
+					pipe.write(b'D %s\n' % quote_fast_import_path(path))
+				else:
+					pipe.write(b'M %o %s %s\n' % (mode, sha1.encode(), quote_fast_import_path(path)))
+				continue
+
+			pipe.write(b'\nget-mark :%d\n' % mark)
+			commit = self.read_response()
+
+			self.commit_marks[commit] = mark
+			self.commit_trees[commit] = tree
+		return commit
+
+	def tag(self, tagname, sha1, message:bytes, tagger):
+		with self.lock:
+			self.pipe.write(b'tag %s\nfrom %s\n' % (tagname.encode('utf-8'), self.get_dataref(sha1)))
+			if tagger:
+				self.pipe.write(b'tagger %s\n' % tagger.encode('utf-8'))
+			self.write_data(message)
+		return
+
+	def reset(self, ref, sha1):
+		with self.lock:
+			self.pipe.write(b'reset %s\nfrom %s\n\n' % (ref.encode('utf-8'), self.get_dataref(sha1)))
+		return
+
+	### checkpoint() makes all objects written so far visible to other Git commands
+	def checkpoint(self):
+		with self.lock:
+			if not self.last_mark:
+				return
+			self.pipe.write(b'checkpoint\n\nget-mark :%d\n' % self.last_mark)
+			self.read_response()
+		return
+
+	### close() finishes the stream and waits for the process to write the pack and refs
+	def close(self):
+		with self.lock:
+			if self.process is None:
+				return
+			self.pipe.write(b'reset %s\nfrom %s\n\ndone\n' % (self.REFNAME.encode(), NULL_SHA1.encode()))
+			self.pipe.close()
+			self.process.stdout.close()
+			self.process.wait()
+			returncode = self.process.returncode
+			self.process = None
+
+		if returncode:
+			raise subprocess.CalledProcessError(returncode, "git fast-import")
+		return
+
+### loose_object_writer writes zlib-compressed loose objects directly to the objects directory,
+# the same way as "git hash-object -w" does.
+# An object is written to a temporary file first, then renamed to its final name,
+# so other Git processes never see a partially written object.
+class loose_object_writer:
+	def __init__(self, objects_dir : Path):
+		self.objects_dir = objects_dir
+		self.dirs_made = set()
+		return
+
+	def write(self, obj_type:bytes, data:bytes, sha1=None):
+		header = b'%s %d\0' % (obj_type, len(data))
+		if sha1 is None:
+			h = hashlib.sha1(header)
+			h.update(data)
+			sha1 = h.hexdigest()
+
+		obj_dir = self.objects_dir.joinpath(sha1[:2])
+		obj_path = obj_dir.joinpath(sha1[2:])
+		if obj_path.exists():
+			return sha1
+
+		if sha1[:2] not in self.dirs_made:
+			obj_dir.mkdir(exist_ok=True)
+			self.dirs_made.add(sha1[:2])
+
+		compressor = zlib.compressobj(zlib.Z_BEST_SPEED)
+		fd, tmp_path = tempfile.mkstemp(prefix='tmp_obj_', dir=obj_dir)
+		try:
+			with open(fd, 'wb') as f:
+				f.write(compressor.compress(header))
+				f.write(compressor.compress(data))
+				f.write(compressor.flush())
+			os.chmod(tmp_path, 0o444)
+			os.replace(tmp_path, obj_path)
+		except:
+			Path(tmp_path).unlink(missing_ok=True)
+			raise
+		return sha1
+
+### hash_object_worker runs a long-lived "git hash-object -w --stdin-paths" process.
+# Git applies .gitattributes conversions by the path of the hashed file.
+# To hash the data as if it was at the given path of the work tree,
+# the worker has its private directory, with copies of all .gitattributes files
+# of the work tree. The data is written to the file at the given path
+# in the private directory, and the file is deleted after hashing.
+# The private directory is used as GIT_WORK_TREE for the process.
+# The worker is only used by one thread at a time.
+class hash_object_worker:
+	def __init__(self, work_dir : Path, private_dir : Path, env, no_filters):
+		self.private_dir = private_dir
+
+		shutil.rmtree(private_dir, ignore_errors=True)
+		private_dir.mkdir(parents=True)
+		for attr_file in work_dir.rglob('.gitattributes'):
+			dest_file = private_dir.joinpath(attr_file.relative_to(work_dir))
+			dest_file.parent.mkdir(parents=True, exist_ok=True)
+			shutil.copyfile(attr_file, dest_file)
+
+		env = env.copy()
+		env['GIT_WORK_TREE'] = str(private_dir)
+		self.process = subprocess.Popen(["git", "-c", "core.safecrlf=false", "hash-object", "-t", "blob", "-w", "--stdin-paths",
+						*(["--no-filters"] if no_filters else [])],
+						stdin=subprocess.PIPE, stdout=subprocess.PIPE, cwd=private_dir, env=env)
+		GIT.TOTAL_GIT_HASH_PROCESSES += 1
+		return
+
+	### hash() returns None if the data cannot be placed at this path in the private directory.
+	# The caller then falls back to a separate "git hash-object" invocation
+	def hash(self, data, path):
+		if path.startswith('"') or '\n' in path \
+			or path == '.gitattributes' or path.endswith('/.gitattributes'):
+			return None
+
+		file_path = self.private_dir.joinpath(path)
+		try:
+			file_path.parent.mkdir(parents=True, exist_ok=True)
+			file_path.write_bytes(data)
+		except OSError:
+			return None
+
+		try:
+			self.process.stdin.write(path.encode('utf-8') + b'\n')
+			self.process.stdin.flush()
+			sha1 = self.process.stdout.readline().decode().rstrip('\n')
+		finally:
+			file_path.unlink()
+
+		if not sha1:
+			raise subprocess.CalledProcessError(self.process.wait(), "git hash-object --stdin-paths")
+		return sha1
+
+	def close(self):
+		self.process.stdin.close()
+		self.process.stdout.close()
+		self.process.wait()
+		shutil.rmtree(self.private_dir, ignore_errors=True)
+		return
+
 ### GIT: controls operations in Git repo
 class GIT:
 	TOTAL_GIT_HASHED_FILES = 0
 	TOTAL_GIT_HASHED_SIZE = 0
 	TOTAL_GIT_COMMITS_MADE = 0
-
-	def __init__(self, path=None):
+	TOTAL_GIT_HASH_PROCESSES = 0
+	# Each thread keeps this many hash-object workers for most recently used work directories
+	MAX_HASH_WORKERS_PER_THREAD = 2
+	# Maximum number of concurrently running Git processes, per Git command.
+	# Other commands are limited by DEFAULT_PROCESS_LIMIT
+	PROCESS_LIMITS = {
+		'hash-object' : 8,
+		'update-index' : 4,
+		'write-tree' : 1,
+		'commit-tree' : 4,
+		'update-ref' : 1,
+	}
+	DEFAULT_PROCESS_LIMIT = 4
+
+	def __init__(self, path=None, backend='subprocess'):
 		self.repo_path = Path(path)
 		# List of queued ref updates. "git update-ref --stdin" is used to run bulk update
 		self.pending_ref_delete = []
 		self.pending_ref_updates = []
-		self.futures_executor = concurrent.futures.ThreadPoolExecutor(max_workers=min(32, os.cpu_count()+4))
+		# Ref updates to be written directly to packed-refs file, if possible
+		self.pending_packed_ref_updates = []
+		# Short-lived Git processes are run by the common asyncio loop.
+		# These semaphores limit number of concurrent processes for each command
+		self.process_semaphores = {}
+
+		# With 'fast-import' backend, blobs, commits and tags are streamed
+		# to a single "git fast-import" process.
+		# With 'native' backend, tree objects are made by this program from in-memory staged trees,
+		# and written as loose objects, instead of using Git index files.
+		# With both, the staged trees are kept in memory, instead of Git index files.
+		self.fast_import = None
+		self.in_memory_index = False
+		# Blobs are hashed and written by this program, unless the conversion by Git attributes
+		# can't be emulated. Then they are hashed by "git hash-object"
+		self.loose_objects = None
+		# Tree objects already written by write_index_tree()
+		self.trees_written = set()
+		# Parsed .gitattributes files, keyed by work directory.
+		# None value means the attributes can't be emulated
+		self.attributes_stacks = {}
+		self.attributes_lock = threading.Lock()
+		self.autocrlf = None
+		self.global_attributes_files = None
+		# (name, email) tuples of default Git identities, keyed by 'AUTHOR' or 'COMMITTER'
+		self.default_idents = {}
+		if backend == 'fast-import':
+			self.fast_import = fast_import(self.repo_path)
+			self.in_memory_index = True
+		elif backend == 'native':
+			self.in_memory_index = True
+
+		# Per-thread ordered dictionaries of hash_object_worker, keyed by (work_dir, no_filters, generation)
+		self.thread_hash_workers = threading.local()
+		# A worker reads .gitattributes files of its work directory only once, when started.
+		# The generation of a work directory is incremented when they are rewritten,
+		# then the workers started before are not used anymore
+		self.attributes_generations = {}
+		self.all_hash_workers = set()
+		self.hash_workers_lock = threading.Lock()
+		self.hash_worker_seq = 0
 
 		return
 
 	def shutdown(self):
-		return self.futures_executor.shutdown()
+		if self.fast_import is not None:
+			self.fast_import.close()
+		with self.hash_workers_lock:
+			for worker in self.all_hash_workers:
+				worker.close()
+			self.all_hash_workers.clear()
+		return
+
+	### get_hash_object_worker() returns a hash-object worker of the current thread
+	# for the work directory of the given environment.
+	# The workers are only used when the environment specifies a work directory
+	def get_hash_object_worker(self, env, no_filters):
+		work_dir = env.get('GIT_WORK_TREE') if env else None
+		if not work_dir:
+			return None
+
+		workers = getattr(self.thread_hash_workers, 'workers', None)
+		if workers is None:
+			workers = OrderedDict()
+			self.thread_hash_workers.workers = workers
+
+		key = (work_dir, no_filters, self.attributes_generations.get(work_dir, 0))
+		worker = workers.get(key)
+		if worker is not None:
+			workers.move_to_end(key)
+			return worker
+
+		# Close this thread's workers started with old .gitattributes files
+		for old_key in [old_key for old_key in workers if old_key[0] == work_dir and old_key[2] != key[2]]:
+			self.close_hash_object_worker(workers.pop(old_key))
+
+		work_dir = Path(work_dir)
+		with self.hash_workers_lock:
+			self.hash_worker_seq += 1
+			private_dir = work_dir.parent.joinpath('hash-object.%d' % self.hash_worker_seq)
+
+		worker = hash_object_worker(work_dir, private_dir, env, no_filters)
+		workers[key] = worker
+		with self.hash_workers_lock:
+			self.all_hash_workers.add(worker)
+
+		while len(workers) > self.MAX_HASH_WORKERS_PER_THREAD:
+			key, old_worker = workers.popitem(last=False)
+			self.close_hash_object_worker(old_worker)
+		return worker
+
+	def close_hash_object_worker(self, worker):
+		with self.hash_workers_lock:
+			if worker not in self.all_hash_workers:
+				return
+			self.all_hash_workers.remove(worker)
+			worker.close()
+		return
+
+	### get_attributes_stack() returns git_attributes.attributes_stack
+	# for the work directory of the given environment,
+	# or None if the attributes can't be emulated
+	def get_attributes_stack(self, env):
+		work_dir = env.get('GIT_WORK_TREE') if env else None
+		stack = self.attributes_stacks.get(work_dir, False)
+		if stack is not False:
+			return stack
+
+		with self.attributes_lock:
+			if self.global_attributes_files is None:
+				self.load_attributes_config()
+			try:
+				stack = git_attributes.attributes_stack(work_dir,
+							self.global_attributes_files, self.info_attributes_files)
+			except (git_attributes.Exception_unsupported_attributes, UnicodeDecodeError):
+				stack = None
+			self.attributes_stacks[work_dir] = stack
+		return stack
+
+	def load_attributes_config(self):
+		self.autocrlf = False
+		attributes_file = None
+		p = subprocess.Popen(["git", "config", "--get-regexp", r"^core\.(autocrlf|attributesfile)$"],
+						stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, cwd=self.repo_path)
+		for line in p.stdout:
+			# A key without a value is printed without the separating space
+			key, sep, value = line.decode().rstrip('\r\n').partition(' ')
+			if key == 'core.attributesfile':
+				attributes_file = Path(value).expanduser()
+			elif key == 'core.autocrlf':
+				# 'input' converts CRLF on check-in the same way as 'true'
+				self.autocrlf = value.lower() == 'input' or parse_config_bool(value if sep else None)
+		p.stdout.close()
+		p.wait()
+
+		if attributes_file is None:
+			xdg_config_home = os.environ.get('XDG_CONFIG_HOME')
+			if xdg_config_home:
+				attributes_file = Path(xdg_config_home, 'git', 'attributes')
+			else:
+				attributes_file = Path.home().joinpath('.config', 'git', 'attributes')
+
+		git_dir = Path(self.get_git_dir(True))
+		info_attributes = git_dir.joinpath('info', 'attributes')
+
+		# The list is in the order of increasing precedence: system file, then global file
+		self.global_attributes_files = []
+		system_attributes_file = self.get_system_attributes_file()
+		if system_attributes_file is not None and system_attributes_file.is_file():
+			self.global_attributes_files.append(system_attributes_file)
+		if attributes_file.is_file():
+			self.global_attributes_files.append(attributes_file)
+		self.info_attributes_files = [info_attributes] if info_attributes.is_file() else []
+		return
+
+	### get_system_attributes_file() returns the path of the system-wide attributes file,
+	# which Git reads from $(prefix)/etc/gitattributes, or None if GIT_ATTR_NOSYSTEM is set.
+	# Git before 2.42 doesn't report the path by "git var GIT_ATTR_SYSTEM".
+	# Then the prefix is found from Git exec path, the same way Git Makefile makes sysconfdir
+	def get_system_attributes_file(self):
+		if os.environ.get('GIT_ATTR_NOSYSTEM', '').lower() in ('1', 'true', 'yes', 'on'):
+			return None
+
+		p = subprocess.run(["git", "var", "GIT_ATTR_SYSTEM"], cwd=self.repo_path,
+						stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+		if not p.returncode:
+			return Path(p.stdout.decode().rstrip('\n'))
+
+		p = subprocess.run(["git", "--exec-path"],
+						stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+		if p.returncode:
+			return None
+		# exec path is $(prefix)/libexec/git-core or $(prefix)/lib/git-core
+		prefix = Path(p.stdout.decode().rstrip('\n')).parent.parent
+		if prefix == Path('/usr'):
+			return Path('/etc/gitattributes')
+		return prefix.joinpath('etc', 'gitattributes')
+
+	### drop_attributes_stack() discards the parsed attributes for the work directory of the environment.
+	# It's called when the .gitattributes files in the work directory are rewritten.
+	# The hash-object workers started for the work directory are not used anymore
+	def drop_attributes_stack(self, env):
+		work_dir = env.get('GIT_WORK_TREE') if env else None
+		with self.attributes_lock:
+			self.attributes_stacks.pop(work_dir, None)
+			if work_dir:
+				self.attributes_generations[work_dir] = self.attributes_generations.get(work_dir, 0) + 1
+		return
+
+	### get_crlf_action() returns git_attributes.CONVERT_* action for the path,
+	# or None if the blob needs to be converted by Git
+	def get_crlf_action(self, path, env):
+		stack = self.get_attributes_stack(env)
+		if stack is None:
+			return None
+		try:
+			return git_attributes.get_crlf_action(stack.get_attributes(path), self.autocrlf)
+		except git_attributes.Exception_unsupported_attributes:
+			return None
 
 	def get_cwd(self, env={}):
 		if not env:
 			return self.repo_path
 		return env.get('GIT_WORK_TREE', self.repo_path)
 
-	### hash_object function invokes Git hash-object command to hash the data blob and write it
-	# to the repository object database. The data is hashed as-is, without any conversion
-	def hash_object(self, data, path=None, env=None):
+	### hash_object function hashes the data blob and writes it to the repository object database.
+	# If path is given, the data is converted according to the Git attributes for this path
+	# in the work directory of the environment, as "git hash-object --path=<path>" would do.
+	# If data_sha1 is given, it's the Git ID of the unconverted data, which saves hashing it again.
+	# If the conversion can't be done here (a filter driver applies, for example),
+	# the data is hashed by Git
+	def hash_object(self, data, path=None, env=None, data_sha1=None):
 		if not self.repo_path:
 			return None
 		if isgenerator(data):
@@ -39,74 +623,118 @@ class GIT:
 				for d in data:
 					out_fd.write(d)
 				data = out_fd.getvalue()
-
-		p = subprocess.Popen(["git", "-c", "core.safecrlf=false", "hash-object", "-t", "blob", "-w", "--stdin",
-					("--path=" + path) if path else "--no-filters"],
-					stdin=subprocess.PIPE, stdout=subprocess.PIPE, cwd=self.get_cwd(env), env=env)
-		if not p:
-			return None
-
-		p.stdin.write(data)
-		p.stdin.close()
-		sha1 = p.stdout.readline().decode().rstrip('\n')
+			data_sha1 = None
+
+		if path:
+			crlf_action = self.get_crlf_action(path, env)
+			if crlf_action is None:
+				return self.git_hash_object(data, path, env)
+			converted = git_attributes.convert_to_git(data, crlf_action)
+			if converted is not data:
+				data = converted
+				data_sha1 = None
+
+		if self.fast_import is not None:
+			sha1 = self.fast_import.blob(data, data_sha1)
+		else:
+			sha1 = self.get_loose_object_writer().write(b'blob', data, data_sha1)
 
 		GIT.TOTAL_GIT_HASHED_FILES += 1
 		GIT.TOTAL_GIT_HASHED_SIZE += len(data)
 		return sha1
 
-	### hash_object_async function invokes Git to hash the data blob and write it
-	# to the repository object database.
-	# The result is returned asynchronously, through a proxy object
-	# async_sha1.
-	def hash_object_async(self, data, path=None, env=None):
-
-		class async_sha1:
-			def __init__(self, git, data, path, env):
-				self.future = git.futures_executor.submit(git.hash_object, data, path, env)
-				return
-
-			def __str__(self):
-				if self.future:
-					self.sha1 = self.future.result()
-					self.future = None
+	def get_loose_object_writer(self):
+		if self.loose_objects is None:
+			self.loose_objects = loose_object_writer(Path(self.get_git_dir(True), 'objects'))
+		return self.loose_objects
+
+	### write_index_tree() writes Git tree objects for the in-memory staged tree, bottom-up.
+	# Subdirectories which have already been written are skipped,
+	# thus only the directories along the changed paths are written again
+	def write_index_tree(self, tree:index_tree):
+		if tree.sha1 is not None and tree.sha1 in self.trees_written:
+			return tree.sha1
+
+		for entry in tree.entries.values():
+			if type(entry) is index_tree:
+				self.write_index_tree(entry)
+
+		tree.sha1 = self.get_loose_object_writer().write(b'tree', tree.make_tree_object(), tree.sha1)
+		self.trees_written.add(tree.sha1)
+		return tree.sha1
+
+	### git_hash_object function invokes Git hash-object command to hash the data blob and write it
+	# to the repository object database, with conversions for the given path
+	def git_hash_object(self, data, path, env=None):
+		worker = self.get_hash_object_worker(env, False)
+		if worker is not None:
+			sha1 = worker.hash(data, path)
+			if sha1 is not None:
+				GIT.TOTAL_GIT_HASHED_FILES += 1
+				GIT.TOTAL_GIT_HASHED_SIZE += len(data)
+				return sha1
+
+		GIT.TOTAL_GIT_HASH_PROCESSES += 1
+		sha1 = self.run_git('hash-object', '-t', 'blob', '-w', '--stdin', '--path=' + path,
+					config=('-c', 'core.safecrlf=false'), input=data, cwd=self.get_cwd(env), env=env)
+		sha1 = sha1.decode().rstrip('\n')
 
-				return self.sha1
+		GIT.TOTAL_GIT_HASHED_FILES += 1
+		GIT.TOTAL_GIT_HASHED_SIZE += len(data)
+		return sha1
 
-		return async_sha1(self, data, path, env)
+	def get_process_semaphore(self, command):
+		semaphore = self.process_semaphores.get(command)
+		if semaphore is None:
+			semaphore = asyncio.Semaphore(GIT.PROCESS_LIMITS.get(command, GIT.DEFAULT_PROCESS_LIMIT))
+			self.process_semaphores[command] = semaphore
+		return semaphore
+
+	### run_git_async() coroutine runs a Git command as a child process of the asyncio loop.
+	# The input bytes are fed to its stdin, and its stdout is returned.
+	# The pipes are served by the loop without blocking a thread.
+	# Number of concurrent processes of each command is limited by GIT.PROCESS_LIMITS
+	async def run_git_async(self, command, *args, config=(), input=None, cwd=None, env=None, check=True):
+		async with self.get_process_semaphore(command):
+			p = await asyncio.create_subprocess_exec("git", *config, command, *args,
+						stdin=asyncio.subprocess.DEVNULL if input is None else asyncio.subprocess.PIPE,
+						stdout=asyncio.subprocess.PIPE, cwd=cwd or self.repo_path, env=env)
+			try:
+				stdout, stderr = await p.communicate(input)
+			except asyncio.CancelledError:
+				p.kill()
+				await p.wait()
+				raise
+
+		if check and p.returncode:
+			raise subprocess.CalledProcessError(p.returncode, "git " + command)
+		return stdout
+
+	### run_git() runs a Git command in the asyncio loop, and waits for its result.
+	# It's called from the worker threads
+	def run_git(self, command, *args, **kwargs):
+		return async_loop.call(self.run_git_async(command, *args, **kwargs))
 
 	def make_env(self, work_dir, index_file):
 		return {'GIT_WORK_TREE' : work_dir, 'GIT_INDEX_FILE' : index_file}
 
-	def update_index(self, env=None):
-		return subprocess.Popen(["git", "update-index", "--add", "--force-remove", "--index-info"],
-						stdin=subprocess.PIPE, cwd=self.get_cwd(env),
-						env=env)
+	### update_index_async() coroutine feeds the staged changes to "git update-index --index-info".
+	# index_info is bytes with the whole input
+	async def update_index_async(self, index_info:bytes, env=None):
+		await self.run_git_async('update-index', '--add', '--force-remove', '--index-info',
+						input=index_info, cwd=self.get_cwd(env), env=env)
+		return
 
 	def read_tree(self, *options, env=None):
-		p = subprocess.Popen(["git", "read-tree", *options],
-						stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, cwd=self.get_cwd(env),
-						env=env)
-		if not p:
-			return None
-		p.wait()
-		if p.returncode:
-			raise subprocess.CalledProcessError(p.returncode, "git read-tree")
-
+		self.run_git('read-tree', *options, cwd=self.get_cwd(env), env=env)
 		return
 
-	def write_tree(self, env=None):
-		p = subprocess.Popen(["git", "write-tree"],
-						stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, cwd=self.repo_path,
-						env=env)
-		if not p:
-			return None
-		sha1 = p.stdout.readline().decode().rstrip('\n')
-		p.wait()
-		p.stdout.close()
-		if p.returncode:
-			raise subprocess.CalledProcessError(p.returncode, "git write-tree")
+	async def write_tree_async(self, env=None):
+		sha1 = await self.run_git_async('write-tree', env=env)
+		return sha1.decode().rstrip('\n')
 
-		return sha1
+	def write_tree(self, env=None):
+		return async_loop.call(self.write_tree_async(env))
 
 	def config(self, env=None):
 		p = subprocess.Popen(["git", "config", "--list"],
@@ -117,6 +745,30 @@ class GIT:
 
 		return
 
+	### get_git_common_dir() returns the absolute path of the common Git directory,
+	# where refs and objects are kept
+	def get_git_common_dir(self):
+		p = subprocess.Popen(["git", "-C", self.repo_path, "rev-parse", "--git-common-dir"],
+						stdin=subprocess.DEVNULL, stdout=subprocess.PIPE)
+		if not p:
+			return None
+		result = p.stdout.readline().decode().rstrip('\n')
+		p.wait()
+		p.stdout.close()
+		if p.returncode:
+			raise subprocess.CalledProcessError(p.returncode, "git rev-parse")
+		return str(Path(self.repo_path, result).resolve())
+
+	def get_config_value(self, name):
+		p = subprocess.Popen(["git", "config", "--get", name],
+						stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, cwd=self.repo_path)
+		if not p:
+			return None
+		result = p.stdout.readline().decode().rstrip('\n')
+		p.wait()
+		p.stdout.close()
+		return result if not p.returncode else None
+
 	def get_git_dir(self, absolute=True):
 		p = subprocess.Popen(["git", "-C", self.repo_path, "rev-parse", "--absolute-git-dir" if absolute else "--git-dir"],
 						stdin=subprocess.DEVNULL, stdout=subprocess.PIPE)
@@ -151,6 +803,9 @@ class GIT:
 		return result.decode()
 
 	def show(self, *options):
+		if self.fast_import is not None:
+			# Make the newly written objects visible
+			self.fast_import.checkpoint()
 		p = subprocess.Popen(["git", "show", *options],
 						stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
 						cwd=self.repo_path)
@@ -195,34 +850,42 @@ class GIT:
 			raise subprocess.CalledProcessError(p.returncode, "git for-each-ref")
 		return empty
 
-	def tag(self, tagname, sha1, message : list, tagger, email, date, *options, env=None):
-		if not env:
-			env = {}
-		else:
-			env = env.copy()
-		if tagger:
-			env["GIT_COMMITTER_NAME"] = tagger
-			env["GIT_COMMITTER_EMAIL"] = email
-
-		if date:
-			env["GIT_COMMITTER_DATE"] = date
-
-		arg_list = ["git", "tag", tagname, sha1, '-a', *options]
-
-		for msg in message:
-			arg_list += ['-m', msg]
-
-		p = subprocess.Popen(arg_list,
-						stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL,
-						cwd=self.repo_path, env=env)
-		if not p:
-			return None
-
-		p.wait()
+	### tag() makes an annotated tag object for the commit sha1.
+	# With fast-import backend, the tag is streamed to fast-import.
+	# Otherwise, the tag object is written as a loose object, and the ref update is queued,
+	# to be done by commit_refs_update() together with all other refs.
+	# The tag object is the same as "git tag -a -m <message>..." would make
+	def tag(self, tagname, sha1, message : list, tagger, email, date):
+		if not tagger:
+			tagger, email = self.get_default_ident('COMMITTER')
+		elif not email:
+			email = tagger + '@localhost'
+		tag_message = make_tag_message(message).encode('utf-8')
+		tagger_ident = format_ident(tagger, email, date)
+
+		if self.fast_import is not None:
+			self.fast_import.tag(tagname, sha1, tag_message, tagger_ident)
+			return
 
-		if p.returncode:
-			raise subprocess.CalledProcessError(p.returncode, "git tag")
-		return
+		data = b'object %s\ntype commit\ntag %s\ntagger %s\n\n%s' % (
+			sha1.encode(), tagname.encode('utf-8'), tagger_ident.encode('utf-8'), tag_message)
+		tag_sha1 = self.get_loose_object_writer().write(b'tag', data)
+		self.queue_update_ref('refs/tags/' + tagname, tag_sha1)
+		return tag_sha1
+
+	### get_default_ident() returns (name, email) of the identity Git uses for a commit or tag
+	# when it's not given explicitly, from user.name/user.email config or GIT_<kind>_NAME/EMAIL environment.
+	# kind is 'AUTHOR' or 'COMMITTER'. "git var" is only run once for each kind
+	def get_default_ident(self, kind):
+		ident = self.default_idents.get(kind)
+		if ident is None:
+			var = self.run_git('var', 'GIT_%s_IDENT' % kind).decode('utf-8').rstrip('\n')
+			m = re.fullmatch(r'(.*) <(.*)> \d+ [-+]\d{4}', var)
+			if not m:
+				raise ValueError('Unexpected "git var GIT_%s_IDENT" output: %s' % (kind, var))
+			ident = (m[1], m[2])
+			self.default_idents[kind] = ident
+		return ident
 
 	def tag_info(self, refname):
 		class taginfo:
@@ -246,7 +909,12 @@ class GIT:
 	def commit_tree(self, tree, parents, message_list,
 				author_name=None, author_email=None, author_date=None,
 				committer_name=None, committer_email=None, committer_date=None,
-				env=None):
+				env=None, tree_index=None):
+		if self.fast_import is not None:
+			return self.fast_import_commit(tree_index, parents, message_list,
+					author_name, author_email, author_date,
+					committer_name, committer_email, committer_date)
+
 		# the commit ID will be output on stdout
 		if not env:
 			env = {}
@@ -278,59 +946,237 @@ class GIT:
 		if not message_list:
 			message_list = ['No message']
 
-		p = subprocess.Popen(["git", "commit-tree", tree, *options_list],
-						stdin=subprocess.PIPE, stdout=subprocess.PIPE, cwd=self.repo_path,
-						env=env)
-		if not p:
-			return None
+		commit = self.run_git('commit-tree', tree, *options_list,
+						input='\n\n'.join(message_list).encode(encoding='utf=8'), env=env)
+		commit = commit.decode().rstrip('\n')
 
-		p.stdin.write('\n\n'.join(message_list).encode(encoding='utf=8'))
-		p.stdin.close()
+		GIT.TOTAL_GIT_COMMITS_MADE += 1
+		return commit
 
-		commit = p.stdout.readline().decode().rstrip('\n')
-		p.wait()
-		p.stdout.close()
-		if p.returncode:
-			raise subprocess.CalledProcessError(p.returncode, "git commit-tree")
+	def fast_import_commit(self, tree_index, parents, message_list,
+				author_name, author_email, author_date,
+				committer_name, committer_email, committer_date):
+		# Same as "git commit-tree" does: missing identities are taken from Git configuration
+		if not author_name:
+			author_name, author_email = self.get_default_ident('AUTHOR')
+		elif not author_email:
+			author_email = author_name + '@localhost'
+		if not committer_name:
+			committer_name, committer_email = self.get_default_ident('COMMITTER')
+		elif not committer_email:
+			committer_email = committer_name + '@localhost'
+
+		if not message_list:
+			message_list = ['No message']
+
+		commit = self.fast_import.commit(tree_index, parents,
+						'\n\n'.join(message_list).encode(encoding='utf=8'),
+						format_ident(author_name, author_email, author_date),
+						format_ident(committer_name, committer_email, committer_date))
 
 		GIT.TOTAL_GIT_COMMITS_MADE += 1
 		return commit
 
-	def queue_update_ref(self, ref, sha1):
+	### write_notes() makes a new commit for Git notes ref, with the given notes added to the existing notes.
+	# notes is a dictionary of note data (bytes), keyed by SHA1 of the annotated object.
+	# All objects are written in one pass, without running "git notes" for each note.
+	# Returns the new notes commit SHA1. The caller needs to update the ref
+	def write_notes(self, notes_ref, notes, message):
+		writer = self.get_loose_object_writer()
+
+		parent = None
+		for line in self.for_each_ref('--format=%(objectname) %(refname)', notes_ref):
+			sha1, _, refname = line.partition(' ')
+			if refname == notes_ref:
+				parent = sha1
+				break
+
+		# Note blobs (mode, SHA1), keyed by annotated object SHA1
+		entries = {}
+		if parent is not None:
+			p = subprocess.Popen(["git", "ls-tree", "-r", parent],
+						stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, cwd=self.repo_path)
+			for line in p.stdout:
+				info, _, path = line.decode().rstrip('\n').partition('\t')
+				mode, obj_type, sha1 = info.split()
+				# Remove fan-out directories
+				entries[path.replace('/', '')] = (int(mode, 8), sha1)
+			p.stdout.close()
+			p.wait()
+			if p.returncode:
+				raise subprocess.CalledProcessError(p.returncode, "git ls-tree")
+
+		for sha1, data in notes.items():
+			entries[sha1] = (0o100644, writer.write(b'blob', data))
+
+		# As Git does, use fan-out directories for the notes
+		# only if there are too many of them for a single tree
+		fanout = len(entries) > 255
+		tree = index_tree()
+		unshared = {id(tree)}
+		for sha1, entry in entries.items():
+			tree.set_path(sha1[:2] + '/' + sha1[2:] if fanout else sha1, entry, unshared)
+
+		ident = format_ident('hg-to-git', 'hg-to-git@localhost', None).encode('utf-8')
+		data = b'tree %s\n' % self.write_index_tree(tree).encode()
+		if parent is not None:
+			data += b'parent %s\n' % parent.encode()
+		data += b'author %s\ncommitter %s\n\n%s' % (ident, ident, cleanup_message(message).encode('utf-8'))
+		return writer.write(b'commit', data)
+
+	### queue_update_ref() queues the ref update, to be done by commit_refs_update().
+	# If packed is True, the ref may be written directly to packed-refs file.
+	# Such refs must point to commits, not to tags
+	def queue_update_ref(self, ref, sha1, packed=False):
+		if packed:
+			return self.pending_packed_ref_updates.append((ref, sha1))
 		return self.pending_ref_updates.append((ref, sha1))
 
 	def queue_delete_ref(self, ref):
 		return self.pending_ref_delete.append(ref)
 
 	def commit_refs_update(self):
-		if not self.pending_ref_updates and not self.pending_ref_delete:
-			return
-		p = subprocess.Popen(["git", "update-ref", "--stdin"],
-					stdin=subprocess.PIPE, stdout=subprocess.DEVNULL, cwd=self.repo_path)
+		if self.fast_import is not None:
+			return self.fast_import_refs_update()
+
+		if self.pending_ref_updates or self.pending_ref_delete:
+			self.update_refs(self.pending_ref_delete, self.pending_ref_updates)
+			self.pending_ref_delete = []
+			self.pending_ref_updates = []
+
+		if self.pending_packed_ref_updates:
+			# The deleted refs are gone by now, and don't conflict with the new refs
+			rejected_ref_updates = self.write_packed_refs(self.pending_packed_ref_updates)
+			self.pending_packed_ref_updates = []
+			if rejected_ref_updates:
+				self.update_refs([], rejected_ref_updates)
+		return
+
+	def update_refs(self, ref_deletes, ref_updates):
+		commands = []
+		if ref_deletes:
+			# If a ref being deleted conflicts with a directory for a ref being created,
+			# the delete would fail because the whole operation would have to be performed at once.
+			# Thus, we delete the refs in one transaction, and update the refs in another
+			commands.append(b'start\n')
+			for ref in ref_deletes:
+				commands.append(bytes('delete "%s"\n' % ref, encoding='utf-8'))
+			commands.append(b'commit\n')
+
+		commands.append(b'start\n')
+		for ref, sha1 in ref_updates:
+			commands.append(bytes('update "%s" %s\n' % (ref, sha1), encoding='utf-8'))
+		commands.append(b'commit\n')
+
 		try:
-			if self.pending_ref_delete:
-				# If a ref being deleted conflicts with a directory for a ref being created,
-				# the delete would fail because the whole operation would have to be performed at once.
-				# Thus, we delete the refs in one transaction, and update the refs in another
-				p.stdin.write(b'start\n')
-				for ref in self.pending_ref_delete:
-					p.stdin.write(bytes('delete "%s"\n' % ref, encoding='utf-8'))
-				p.stdin.write(b'commit\n')
-
-			p.stdin.write(b'start\n')
-			for ref, sha1 in self.pending_ref_updates:
-				p.stdin.write(bytes('update "%s" %s\n' % (ref, sha1), encoding='utf-8'))
-			p.stdin.write(b'commit\n')
+			self.run_git('update-ref', '--stdin', input=b''.join(commands), check=False)
 		except OSError:
-			#print("OSError thrown for ref %s sha %s", file=sys.stderr)
 			exit(22)
-		p.stdin.close()
-		p.wait()
+		return
 
-		self.pending_ref_delete = []
-		self.pending_ref_updates = []
+	### write_packed_refs() writes the refs directly to packed-refs file, instead of making loose refs
+	# by "git update-ref". The existing packed refs are kept, or replaced by the new values.
+	# If any ref exists as a loose ref, which would override the packed ref,
+	# or conflicts with an existing or another new ref as a file vs directory, nothing is written.
+	# All the refs are then returned, to be updated by "git update-ref" in one transaction,
+	# which will handle or report the conflict. Otherwise, an empty list is returned.
+	# The new file is written under packed-refs.lock name, as Git does, then renamed over packed-refs
+	def write_packed_refs(self, ref_updates):
+		if (self.get_config_value('extensions.refStorage') or 'files') != 'files':
+			return ref_updates
+
+		git_dir = Path(self.get_git_common_dir())
+		packed_refs_path = git_dir.joinpath('packed-refs')
+		lock_path = git_dir.joinpath('packed-refs.lock')
+		try:
+			lock_fd = os.open(lock_path, os.O_WRONLY|os.O_CREAT|os.O_EXCL, 0o666)
+		except FileExistsError:
+			return ref_updates
+
+		try:
+			traits, packed_refs = read_packed_refs(packed_refs_path)
+
+			loose_refs = set()
+			for dirpath, dirnames, filenames in os.walk(git_dir.joinpath('refs')):
+				refs_dir = Path(dirpath).relative_to(git_dir).as_posix()
+				for filename in filenames:
+					if not filename.endswith('.lock'):
+						loose_refs.add(refs_dir + '/' + filename)
+
+			new_refs = set(ref for ref, sha1 in ref_updates)
+			# Directories of all existing and new refs, with trailing slash
+			existing_dirs = set()
+			for ref in (*packed_refs, *loose_refs, *new_refs):
+				while True:
+					ref = ref.rpartition('/')[0]
+					if not ref or ref + '/' in existing_dirs:
+						break
+					existing_dirs.add(ref + '/')
+					continue
+
+			def can_pack(ref):
+				if ref in loose_refs or ref + '/' in existing_dirs:
+					return False
+				# Check if any parent directory of the ref is an existing or new ref
+				directory = ref.rpartition('/')[0]
+				while directory:
+					if directory in packed_refs or directory in loose_refs or directory in new_refs:
+						return False
+					directory = directory.rpartition('/')[0]
+				return True
+
+			if not all(can_pack(ref) for ref, sha1 in ref_updates):
+				# Nothing is written. All refs are updated by "git update-ref" in one transaction,
+				# which fails as a whole if a ref conflicts
+				os.close(lock_fd)
+				lock_fd = None
+				lock_path.unlink()
+				return ref_updates
+
+			for ref, sha1 in ref_updates:
+				# The new ref points to a commit, and doesn't need a peeled line
+				packed_refs[ref] = (sha1, None)
+				continue
+
+			with open(lock_fd, 'wb', 0x100000) as fd:
+				lock_fd = None
+				fd.write(b'# pack-refs with: %s\n' % b''.join(b'%s ' % trait for trait in traits))
+				for ref, (sha1, peeled) in sorted((ref.encode('utf-8'), value) for ref, value in packed_refs.items()):
+					fd.write(b'%s %s\n' % (sha1.encode(), ref))
+					if peeled is not None:
+						fd.write(b'^%s\n' % peeled.encode())
+			os.replace(lock_path, packed_refs_path)
+		except:
+			if lock_fd is not None:
+				os.close(lock_fd)
+			lock_path.unlink(missing_ok=True)
+			raise
+
+		return []
+
+	### With fast-import, the refs to the new commits are written by fast-import when it finishes.
+	# The refs to be deleted and the refs to pre-existing objects are updated by "git update-ref"
+	def fast_import_refs_update(self):
+		# The refs are deleted first, before fast-import writes its refs,
+		# as update_refs() does. A pruned ref may be written again, or replaced by a ref under it
+		if self.pending_ref_delete:
+			self.update_refs(self.pending_ref_delete, [])
+			self.pending_ref_delete = []
+
+		pending_ref_updates = []
+		for ref, sha1 in self.pending_ref_updates:
+			if sha1 in self.fast_import.commit_marks:
+				self.fast_import.reset(ref, sha1)
+			else:
+				pending_ref_updates.append((ref, sha1))
+
+		self.fast_import.close()
+		self.fast_import = None
+
+		self.pending_ref_updates = pending_ref_updates
+		return self.commit_refs_update()
 
 def print_stats(fd):
-	print("Git hash-object invoked: %d times, %d MiB hashed" % (
-		GIT.TOTAL_GIT_HASHED_FILES, GIT.TOTAL_GIT_HASHED_SIZE//0x100000), file=fd)
+	print("Git hash-object invoked: %d times, %d MiB hashed, %d processes started" % (
+		GIT.TOTAL_GIT_HASHED_FILES, GIT.TOTAL_GIT_HASHED_SIZE//0x100000, GIT.TOTAL_GIT_HASH_PROCESSES), file=fd)
 	print("Git commits made: %d" % (GIT.TOTAL_GIT_COMMITS_MADE), file=fd)
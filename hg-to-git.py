@@ -27,12 +27,30 @@ def main():
 	import argparse
 	parser = argparse.ArgumentParser(description="Convert Mercurial repository to Git", allow_abbrev=False)
 	parser.add_argument('--version', action='version', version='%(prog)s 1.0')
-	parser.add_argument(dest='in_repository', help="Mercurial repository root directory")
+	parser.add_argument(dest='in_repository', nargs='?', help="Mercurial repository root directory")
 	parser.add_argument("--log", dest='log_file', help="Logfile destination; default to stdout")
 	parser.add_argument("--verbose", "-v", dest='verbose', help="Log verbosity:",
 						choices=['dump', 'dump_all', 'revs', 'commits', 'format', 'format-verbose', 'all'],
 						action='append', nargs='?', const=['dump', 'commits'], default=[])
 	parser.add_argument("--end-revision", "-e", metavar='REV', dest='end_revision', help="Revision to stop the input file processing")
+	parser.add_argument("--prefetch-depth", type=int, default=0, metavar='N',
+					help="Number of revisions to read file contents ahead of processing, in a separate thread (default 0, disabled)")
+	parser.add_argument("--prefetch-size", type=int, default=256, metavar='MiB',
+					help="Maximum size of file contents read ahead and not yet processed, in MiB (default 256)")
+	parser.add_argument("--blob-memory-size", type=int, default=256, metavar='MiB',
+					help="Maximum size of file contents kept in memory, in MiB. Other contents are read again or spilled to a temporary file (default 256)")
+	parser.add_argument("--skip-unused-history", action='store_true',
+					help="Don't read files of revisions not needed for any mapped branch, and files ignored in all projects")
+	parser.add_argument("--reader-process", action='store_true',
+					help="Read the Mercurial repository in a separate process")
+	parser.add_argument("--dump-stream", metavar='FILE',
+					help="Write the revisions read from the Mercurial repository to a stream file, to be replayed by --replay-stream")
+	parser.add_argument("--replay-stream", metavar='FILE',
+					help="Read the revisions from a stream file written by --dump-stream, instead of the Mercurial repository")
+	parser.add_argument("--state-file", metavar='FILE',
+					help="File to save the conversion state, and resume the conversion from it, converting only new revisions")
+	parser.add_argument("--verify-state", action='store_true',
+					help="Check that the conversion state saved to --state-file loads back the same")
 	parser.add_argument("--extract-file", "-X", metavar='PATH;<revision> <dest filename>',
 						dest='extract_file', nargs=2, action='append', default=[],
 						help="Extract a file by database path and revision timestamp")
@@ -50,12 +68,19 @@ def main():
 	parser.add_argument("--project", dest='project_filter', default=[], action='append',
 					help="Process only selected projects. The option value is Git-style globspec")
 	parser.add_argument("--target-repository", dest='target_repo', help="Target Git repository to write the conversion result")
+	parser.add_argument("--backend", choices=['subprocess', 'native', 'fast-import'], default='subprocess',
+					help="Method to write Git objects: run Git commands to stage and write trees (default), write trees directly ('native'), or stream objects to 'git fast-import'")
+	parser.add_argument("--index-pool-size", type=int, default=4, metavar='N',
+					help="Number of Git index files each branch keeps for reuse as staging bases (default 4)")
 	parser.add_argument("--decorate-commit-message", help="Add taglines to the commit message:", choices=['revision-id', 'change-id'],
 						action='append', default=[])
 	parser.add_argument("--create-revision-refs", default=False,
 					help="Create refs under refs/revisions for each revision on each branch",
 					action='store_true')
+	parser.add_argument("--revision-notes", nargs='?', const='refs/notes/hg', metavar='refs/notes/<name>',
+					help="Write HG revision number and node ID for each commit as Git notes, under the given ref (default refs/notes/hg)")
 	parser.add_argument("--sha1-map", '-S', help="Text file to map source blobs with attributes to Git SHA1")
+	parser.add_argument("--filenode-map", help="Text file to map Mercurial filenodes to contents length and SHA1")
 	parser.add_argument("--authors-map", '-A', dest='authors_map', help="JSON file to map Mercurial usernames to Git names and emails")
 	parser.add_argument("--make-authors-map", dest='make_authors', help="Create a JSON template for users file, to be used as --users-map file")
 	parser.add_argument("--append-to-refs", action='append', default=[], metavar='refs/prev-repo-heads-and-tags', help="refs root of previous repository, see README")
@@ -89,13 +114,40 @@ def main():
 	options.decorate_revision_id = 'revision-id' in options.decorate_commit_message
 	options.decorate_change_id = 'change-id' in options.decorate_commit_message
 
-	from hg_reader import hg_repository_reader, print_stats as print_hg_stats
+	if options.replay_stream:
+		if options.in_repository or options.dump_stream:
+			parser.error("--replay-stream cannot be used with a Mercurial repository or --dump-stream")
+	elif not options.in_repository:
+		parser.error("Mercurial repository root directory is required")
+
+	if options.state_file and (options.replay_stream or options.dump_stream):
+		parser.error("--state-file cannot be used with --dump-stream or --replay-stream")
+
+	if options.verify_state and not options.state_file:
+		parser.error("--verify-state requires --state-file")
+
+	if options.skip_unused_history and options.reader_process:
+		# The filters are evaluated by the project configuration, which the reader process doesn't have
+		parser.error("--skip-unused-history cannot be used with --reader-process")
+
+	from hg_reader import hg_repository_reader, hg_process_reader, print_stats as print_hg_stats
+	from hg_stream import hg_stream_reader, hg_stream_writer
 	from project_tree import project_history_tree, print_stats as project_tree_stats
 
 	project_tree = project_history_tree(options)
 
 	try:
-		project_tree.load(hg_repository_reader(options.in_repository))
+		if options.replay_stream:
+			reader = hg_stream_reader(options.replay_stream)
+		elif options.reader_process:
+			reader = hg_process_reader(options.in_repository)
+		else:
+			reader = hg_repository_reader(options.in_repository)
+
+		if options.dump_stream:
+			reader = hg_stream_writer(reader, options.dump_stream)
+
+		project_tree.load(reader)
 
 		project_tree.print_unmapped_authors(log_file)
 
@@ -109,7 +161,12 @@ def main():
 
 	return 0
 
-from mercurial.error import RepoError
+try:
+	from mercurial.error import RepoError
+except ImportError:
+	# Mercurial is not needed to replay a stream file
+	class RepoError(Exception):
+		pass
 from exceptions import Exception_history_parse, Exception_cfg_parse
 if __name__ == "__main__":
 	try:
@@ -16,8 +16,17 @@ from __future__ import annotations
 import sys
 import re
 import datetime
-
-from lookup_tree import bytes_path_tree
+import threading
+import queue
+import pickle
+import hashlib
+import traceback
+import multiprocessing
+from array import array
+from types import SimpleNamespace
+from collections import deque
+
+from exceptions import Exception_history_parse
 
 TOKEN_PIPE          = '|'
 TOKEN_QUESTION_MARK = '?'
@@ -278,19 +287,48 @@ def hgeol_to_gitattributes(data):
 
 	return b'\n'.join(lines + [b''])	# Make sure the file ends with \n
 
-def changectx_to_tree(changectx):
-	tree = bytes_path_tree()
-	if changectx is None:
-		return tree
+### hg_file_data loads a file revision contents from the repository, when called.
+# It keeps only the path and the filenode, not the file context
+class hg_file_data:
+	__slots__ = ('repository', 'path', 'filenode', 'prefetched')
+
+	def __init__(self, repository, path:bytes, filenode:bytes):
+		self.repository = repository
+		self.path = path
+		self.filenode = filenode
+		# The contents read ahead by hg_prefetcher
+		self.prefetched = None
+		return
 
-	for filename in changectx:
-		tree.set(filename, changectx[filename])
+	def __call__(self):
+		global TOTAL_FILES_READ, TOTAL_BYTES_READ
+		data = self.prefetched
+		if data is not None:
+			self.prefetched = None
+			return data
+		data = self.repository.file(self.path).read(self.filenode)
+		TOTAL_FILES_READ += 1
+		TOTAL_BYTES_READ += len(data)
+		return data
+
+	# The repository handle is not serialized. The receiving process sets its own
+	def __getstate__(self):
+		return (self.path, self.filenode, self.prefetched)
+
+	def __setstate__(self, state):
+		self.path, self.filenode, self.prefetched = state
+		self.repository = None
+		return
 
-	return tree
+TOTAL_FILES_READ = 0
+TOTAL_BYTES_READ = 0
+TOTAL_FILES_PREFETCHED = 0
+TOTAL_BYTES_PREFETCHED = 0
 
 class hg_revision_node:
 	def __init__(self, action:bytes, kind:bytes, path_or_branch:str|bytes,
-			data:bytes=None, copy_from_rev=None, tag=None, props=None):
+			data:bytes=None, copy_from_rev=None, tag=None, props=None,
+			filenode=None, flags=None, data_source=None, copy_from_path=None):
 		self.action = action
 		self.kind = kind
 		if type(path_or_branch) is bytes:
@@ -299,70 +337,87 @@ class hg_revision_node:
 		self.path = path_or_branch
 		self.tag = tag
 		self.props = props
-		self.copyfrom_path = None
+		if type(copy_from_path) is bytes:
+			copy_from_path = copy_from_path.decode()
+		self.copyfrom_path = copy_from_path
 		self.copyfrom_rev = copy_from_rev
 		self.text_content = data
+		# If the data is not given, it's loaded on demand by data_source
+		self.filenode = filenode
+		self.flags = flags
+		self.data_source = data_source
 		return
 
 	def print(self, fd):
 		print("   NODE %s %s:%s%s" % (self.action.decode(),
 					self.kind.decode() if self.kind is not None else None, self.path,
 					"" if self.action != b'tag' else (', tag: %s' % self.tag)), file=fd)
-		if self.copyfrom_rev is not None:
+		if self.copyfrom_path is not None:
+			print("       COPY FROM: %s;%s" % (self.copyfrom_path, self.copyfrom_rev), file=fd)
+		elif self.copyfrom_rev is not None:
 			print("       COPY FROM: %s" % (self.copyfrom_rev), file=fd)
 		return
 
 class hg_changectx_revision:
 	def __init__(self, reader:hg_repository_reader, changectx, options):
-		self.rev = changectx.rev()
+		index = reader.changelog_index
+		rev = changectx.rev()
+		self.rev = rev
 		self.changectx_node = changectx.node()
-		rev_hex = changectx.hex()
-		self.rev_id = rev_hex.decode()
+		self.repository = reader.repository
+		self.rev_id = changectx.hex().decode()
 		self.author:str = changectx.user().decode()
 		self.log:str = changectx.description().decode()
 		date = changectx.date()
 		tz = datetime.timezone(datetime.timedelta(seconds=date[1]))
 		self.datetime = datetime.datetime.fromtimestamp(date[0], tz=tz)
-		self.branch = changectx.branch().decode()
+		self.branch = index.branch_names[index.branch_ids[rev]]
 		self.parent_revision = None	# direct ancestor
 		self.child_revision = None	# direct descendant
 		self.nodes = []
 		self.convert_hgignore = options.convert_hgignore
 		self.convert_hgeol = options.convert_hgeol
 
-		self.children = [child.hex() for child in changectx.children()]
+		# Number of children in the changelog. The consumer releases the revision tree after applying them all
+		self.total_children = index.children_count[rev]
+		# Number of children not yet processed, which don't continue this revision's branch
+		self.children_count = index.children_count[rev]
 		# If this revision starts another branch, it cannot be skipped
-		self.need_commit = len(self.children) != 1
+		self.need_commit = self.children_count != 1
 
-		parents = []
-		for parent_changectx in changectx.parents():
-			if parent_changectx.node() != b'\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00':
-				parents.append(reader.changectx_dict[parent_changectx.node()])
-			continue
+		parents = [reader.revisions[parent_rev] for parent_rev in index.get_parents(rev)]
+		# These are only used while the file changes are read
+		self.reader = reader
+		self.copy_source_parents = parents.copy()
 
 		if parents:
-			parent_changectx = changectx.parents()[0]
+			parent_changectx = changectx.p1()
 			parent_revision = parents.pop(0)
 			if parent_revision.branch != self.branch:
 				self.add_revision_node(b'add', b'branch', self.branch, copy_from_rev=parent_revision.rev_id)
-				parent_revision.children.remove(rev_hex)
+				parent_revision.children_count -= 1
 			# check if it creates a new sub-branch (splitting a branch with two with same name)
 			elif parent_revision.child_revision is None:
 				# Continue the first parent branch
 				self.parent_revision = parent_revision
 				parent_revision.child_revision = self
-				if len(parent_revision.children) == 1:
-					# Discard old tree to avoid memory usage ballooning
+				if parent_revision.children_count == 1:
+					# Discard old tree to avoid memory usage ballooning.
+					# With read-ahead, this can run before the parent is consumed. It's still safe:
+					# the consumer keeps its own trees in history_revision objects,
+					# and never reads the tree of a reader revision
 					parent_revision.tree = None
 			else:
 				self.add_revision_node(b'add', b'branch', self.branch, copy_from_rev=parent_revision.rev_id)
-				parent_revision.children.remove(rev_hex)
+				parent_revision.children_count -= 1
 		else:
 			self.add_revision_node(b'add', b'branch', self.branch)
 			parent_changectx = None
 
+		# The files are skipped, if this revision is not needed by any mapped branch
 		if len(parents) == 0:
-			self.process_file_list(changectx, parent_changectx)
+			if reader.need_revision_files(rev):
+				self.process_file_list(changectx, parent_changectx)
 		else:
 			# We cannot use changectx.files() for diffs. We have to compare trees
 			# build tree from all files
@@ -370,14 +425,15 @@ class hg_changectx_revision:
 
 			for parent_revision in parents:
 				self.add_revision_node(b'parent', b'branch', None, copy_from_rev=parent_revision.rev_id)
-				parent_revision.children.remove(rev_hex)
+				parent_revision.children_count -= 1
 				# Check if this merge ends a sub-branch
-				if len(parent_revision.children) == 0:
+				if parent_revision.children_count == 0:
 					self.add_revision_node(b'delete', b'branch', parent_revision.rev_id)
 				continue
-			self.compare_change_contexts(parent_changectx, changectx)
+			if reader.need_revision_files(rev):
+				self.compare_change_contexts(parent_changectx, changectx)
 
-		for tag in changectx.tags():
+		for tag in index.tags.get(self.changectx_node, ()):
 			self.create_tag(tag.decode())
 			# If this revision makes a tag, it cannot be skipped
 			self.need_commit = True
@@ -387,42 +443,58 @@ class hg_changectx_revision:
 
 		if cherry_picked_from := self.extra.pop(b'source', None):
 			self.add_revision_node(b'cherrypick', b'branch', None, copy_from_rev=cherry_picked_from.decode())
-		if self.extra.pop(b'close', None):
+		self.extra.pop(b'close', None)
+		if index.closed[rev]:
 			self.add_revision_node(b'delete', b'branch', self.rev_id)
+		del self.reader, self.copy_source_parents
+		return
+
+	### A revision is serialized with its parent revision referred by ID.
+	# The links used only to build the following revisions are not serialized
+	def __getstate__(self):
+		state = self.__dict__.copy()
+		state.pop('repository', None)
+		state.pop('prefetch_done', None)
+		state['parent_revision'] = self.parent_revision.rev_id if self.parent_revision is not None else None
+		state['child_revision'] = None
+		return state
+
+	### attach() restores the references of a deserialized revision.
+	# If the repository is None, the data sources don't need it
+	def attach(self, revision_dict, repository):
+		if self.parent_revision is not None:
+			self.parent_revision = revision_dict[self.parent_revision]
+		self.repository = repository
+		if repository is None:
+			return
+		for node in self.nodes:
+			if node.data_source is not None:
+				node.data_source.repository = repository
 		return
 
 	### Build a changelist for a merge (files() method cannot be used)
+	# The manifests are compared by Mercurial, which returns only the files
+	# with different filenode or flags, as {path: ((node1, flags1), (node2, flags2))}.
+	# A missing file has None node.
 	def compare_change_contexts(self, ctx1, ctx2):
-		tree1 = changectx_to_tree(ctx1)
-		tree2 = changectx_to_tree(ctx2)
-
-		for path, node1, node2 in type(tree1).compare(tree1, tree2):
-
-			if path and path.startswith(b'/'):
-				path = path[1:]
-
-			if node1 is None:
-				# Node2 added
-				if node2.object is not None:
-					self.create_file(path, node2.object)
-				continue
+		diff = ctx1.manifest().diff(ctx2.manifest())
 
+		changed_paths = []
+		for path in sorted(diff):
+			(node1, flags1), (node2, flags2) = diff[path]
 			if node2 is None:
-				# Node1 deleted
-				if node1.object is not None:
-					self.delete_file(path, ctx2, ctx1)
-				# else: empty directories are deleted in the tree
-				continue
+				# Deletions go first, to correctly handle change from a file to a directory,
+				# and the other way around. Note that Mercurial doesn't keep directories.
+				self.delete_file(path, ctx2, ctx1)
+			else:
+				changed_paths.append((path, node1 is None))
+			continue
 
-			# Make sure to correctly handle change from a file to a directory, and the other way around.
-			# Note that Mercurial doesn't keep directories.
-			if node2.object is None:
-				if node1.object is not None:
-					self.delete_file(path, ctx2, ctx1)
-			elif node1.object is None:
-				self.create_file(path, node2.object)
-			elif node1.object.filenode() != node2.object.filenode():
-				self.change_file(path, node2.object)
+		for path, added in changed_paths:
+			if added:
+				self.create_file(path, ctx2[path])
+			else:
+				self.change_file(path, ctx2[path])
 			continue
 		return
 
@@ -439,10 +511,10 @@ class hg_changectx_revision:
 		return
 
 	def add_revision_node(self, action:bytes, kind:bytes, path:str|bytes,
-				data:bytes=None, copy_from_rev=None, tag=None, props=None):
+				data:bytes=None, copy_from_rev=None, tag=None, props=None, **kwargs):
 
 		self.nodes.append(hg_revision_node(action, kind, path,
-					data=data, copy_from_rev=copy_from_rev, tag=tag, props=props))
+					data=data, copy_from_rev=copy_from_rev, tag=tag, props=props, **kwargs))
 		return
 
 	def create_tag(self, tag:str):
@@ -450,24 +522,78 @@ class hg_changectx_revision:
 
 	# If both present, .gitignore comes in the diff list and in the file list before .hgignore
 	# If both get changed. .gitignore gets changed first, then the generated .gitignore overrides it
+	# The file contents are not read here, unless it needs conversion.
+	# The node carries the filenode, and the contents are read when a blob is made of them
 	def change_file(self, path:bytes, fctx, action=b'change'):
-		data = fctx.data()
 		props = {}
 		if fctx.islink():
 			props[b'symlink'] = b'symlink'
 		elif self.convert_hgignore and (path == b'.hgignore' or path.endswith(b'/.hgignore')):
 			path = path.removesuffix(b'.hgignore') + b'.gitignore'
-			data = hgignore_to_gitignore(data)
-			action = b'change'
+			data = hgignore_to_gitignore(fctx.data())
+			return self.add_revision_node(b'change', b'file', path, data=data, props=props)
 		elif self.convert_hgeol and path == b'.hgeol':
-			path = b'.gitattributes'
-			data = hgeol_to_gitattributes(data)
-			action = b'change'
+			data = hgeol_to_gitattributes(fctx.data())
+			return self.add_revision_node(b'change', b'file', b'.gitattributes', data=data, props=props)
 		elif fctx.isexec():
 			props[b'executable'] = b'executable'
-		self.add_revision_node(action, b'file', path, data=data, props=props)
+		filenode = fctx.filenode()
+		data_source = hg_file_data(self.repository, path, filenode)
+		copy_from_path, copy_from_rev = None, None
+		if action == b'add':
+			copy_source = self.get_copy_source(path, fctx)
+			if copy_source is not None:
+				copy_from_path, copy_from_rev, same_contents = copy_source
+				if same_contents:
+					# The blob of the copy source is used
+					data_source = None
+		self.add_revision_node(action, b'file', path, props=props,
+				filenode=filenode, flags=fctx.flags(), data_source=data_source,
+				copy_from_path=copy_from_path, copy_from_rev=copy_from_rev)
 		return
 
+	### get_copy_source() returns a tuple of the source path, the parent revision ID,
+	# and whether the contents are the same as the source, for an added file,
+	# if Mercurial recorded it as copied or renamed, or None.
+	# The file contents are not read for files which are not copies.
+	# For a copy, the contents are compared with the source, unless its filenode is already known.
+	# If they're the same, the copy reuses the source blob, and its contents don't need to be read again
+	def get_copy_source(self, path:bytes, fctx):
+		path_filter = self.reader.path_filter
+		if path_filter is not None and path_filter(path.decode()):
+			# The node will be dropped
+			return None
+
+		renamed = fctx.renamed()
+		if not renamed:
+			return None
+		source_path = renamed[0]
+		if self.convert_hgignore and (source_path == b'.hgignore' or source_path.endswith(b'/.hgignore')):
+			return None
+		if self.convert_hgeol and source_path == b'.hgeol':
+			return None
+		if path_filter is not None and path_filter(source_path.decode()):
+			return None
+
+		known_filenodes = self.reader.known_filenodes
+		for parent_revision in self.copy_source_parents:
+			parent_changectx = self.repository[parent_revision.changectx_node]
+			if source_path not in parent_changectx:
+				continue
+			source_fctx = parent_changectx[source_path]
+			filenode = fctx.filenode()
+			if filenode == source_fctx.filenode():
+				return source_path, parent_revision.rev_id, True
+			data_info = known_filenodes.get(filenode)
+			if data_info is not None:
+				# The contents won't be read anyway. The filenode map of the history reader
+				# keeps (length, hash) of the contents, which can be compared without reading them
+				return source_path, parent_revision.rev_id, \
+					type(data_info) is tuple and data_info == known_filenodes.get(source_fctx.filenode())
+			# fctx.cmp() returns True if the contents are different
+			return source_path, parent_revision.rev_id, not fctx.cmp(source_fctx)
+		return None
+
 	def create_file(self, path:bytes, fctx):
 		return self.change_file(path, fctx, action=b'add')
 
@@ -537,63 +663,479 @@ class hg_changectx_revision:
 		print("", file=fd)
 		return
 
+### hg_changelog_index keeps the revision graph, branches and tags of the whole changelog.
+# It's built in one pass over the changelog index, and keeps the information in compact arrays,
+# instead of getting it from the change context of each revision.
+class hg_changelog_index:
+	def __init__(self, repository):
+		changelog = repository.changelog
+		self.count = len(changelog)
+		# Parent revision numbers, -1 for null revision
+		self.p1 = array('i', [-1]) * self.count
+		self.p2 = array('i', [-1]) * self.count
+		self.children_count = array('I', [0]) * self.count
+		# Branch names are kept in branch_names list, and indexed by branch_ids array
+		self.branch_ids = array('I', [0]) * self.count
+		self.branch_names = []
+		# Branch closing flag, as 0 or 1
+		self.closed = bytearray(self.count)
+
+		branch_ids = {}
+		for rev in range(self.count):
+			p1, p2 = changelog.parentrevs(rev)
+			self.p1[rev] = p1
+			self.p2[rev] = p2
+			if p1 >= 0:
+				self.children_count[p1] += 1
+			if p2 >= 0 and p2 != p1:
+				self.children_count[p2] += 1
+
+			branch, closed = changelog.branchinfo(rev)
+			branch_id = branch_ids.get(branch)
+			if branch_id is None:
+				branch_id = len(self.branch_names)
+				branch_ids[branch] = branch_id
+				self.branch_names.append(branch.decode())
+			self.branch_ids[rev] = branch_id
+			self.closed[rev] = closed
+			continue
+
+		# Tag names, keyed by changeset node. Same as changectx.tags(), the names are sorted
+		self.tags = {}
+		for tag, node in repository.tagslist():
+			self.tags.setdefault(node, []).append(tag)
+		for tags in self.tags.values():
+			tags.sort()
+		return
+
+	def get_parents(self, rev):
+		p1 = self.p1[rev]
+		p2 = self.p2[rev]
+		if p1 < 0:
+			return (p2,) if p2 >= 0 else ()
+		if p2 < 0 or p2 == p1:
+			return (p1,)
+		return (p1, p2)
+
+### hg_converted_revision stands for a revision converted by a previous run,
+# as a parent of the revisions read when the conversion is resumed.
+# It only keeps the part of hg_changectx_revision state used by its children
+class hg_converted_revision:
+	__slots__ = ('rev', 'rev_id', 'changectx_node', 'branch', 'children_count', 'child_revision', 'tree')
+
+	def __init__(self, rev, changectx_node, branch, children_count):
+		self.rev = rev
+		self.changectx_node = changectx_node
+		self.rev_id = changectx_node.hex()
+		self.branch = branch
+		self.children_count = children_count
+		# Only tells if the branch is continued by a child
+		self.child_revision = None
+		self.tree = None
+		return
+
+### hg_prefetcher reads the file contents of revisions ahead of their processing.
+# The contents are read in a separate thread, through its own repository handle,
+# and attached to the nodes' data sources.
+# The total size of contents read ahead and not yet released is limited by max_bytes,
+# except for the revision the consumer is waiting for.
+class hg_prefetcher:
+	def __init__(self, reader:hg_repository_reader, max_bytes):
+		self.reader = reader
+		self.max_bytes = max_bytes
+		self.bytes_in_flight = 0
+		self.waiting_for = None
+		self.cancelled = False
+		# An exception raised in the thread, re-raised to the consumer by wait()
+		self.exception = None
+		self.condition = threading.Condition()
+		self.queue = queue.SimpleQueue()
+		self.thread = threading.Thread(target=self.run, name='hg_prefetcher', daemon=True)
+		self.thread.start()
+		return
+
+	def submit(self, revision):
+		revision.prefetch_done = threading.Event()
+		revision.prefetched_bytes = 0
+		self.queue.put(revision)
+		return
+
+	def run(self):
+		try:
+			repository = self.reader.open_repository()
+			known_filenodes = self.reader.known_filenodes
+
+			while (revision := self.queue.get()) is not None:
+				try:
+					self.prefetch_revision(repository, known_filenodes, revision)
+				finally:
+					revision.prefetch_done.set()
+				continue
+		except BaseException as e:
+			self.exception = e
+			# Don't leave the consumer waiting for the revisions still queued,
+			# until shutdown() queues None
+			while (revision := self.queue.get()) is not None:
+				revision.prefetch_done.set()
+				continue
+		return
+
+	def prefetch_revision(self, repository, known_filenodes, revision):
+		global TOTAL_FILES_PREFETCHED, TOTAL_BYTES_PREFETCHED
+		for node in revision.nodes:
+			data_source = node.data_source
+			if data_source is None or node.filenode in known_filenodes:
+				continue
+			with self.condition:
+				self.condition.wait_for(lambda: self.cancelled
+					or self.bytes_in_flight < self.max_bytes or self.waiting_for is revision)
+				if self.cancelled:
+					break
+			data = repository.file(data_source.path).read(data_source.filenode)
+			data_source.prefetched = data
+			with self.condition:
+				self.bytes_in_flight += len(data)
+			revision.prefetched_bytes += len(data)
+			TOTAL_FILES_PREFETCHED += 1
+			TOTAL_BYTES_PREFETCHED += len(data)
+			continue
+		return
+
+	### wait() waits for the revision contents to be read ahead.
+	# If the read-ahead thread failed, its exception is raised here
+	def wait(self, revision):
+		with self.condition:
+			self.waiting_for = revision
+			self.condition.notify()
+		revision.prefetch_done.wait()
+		if self.exception is not None:
+			raise self.exception
+		return
+
+	### release() drops the contents of an already processed revision, which haven't been consumed
+	def release(self, revision):
+		for node in revision.nodes:
+			if node.data_source is not None:
+				node.data_source.prefetched = None
+		with self.condition:
+			self.bytes_in_flight -= revision.prefetched_bytes
+			self.condition.notify()
+		return
+
+	def shutdown(self):
+		with self.condition:
+			self.cancelled = True
+			self.condition.notify()
+		self.queue.put(None)
+		self.thread.join()
+		return
+
 class hg_repository_reader:
 	def __init__(self, repository_directory:str):
 
+		self.repository_directory = repository_directory
+		self.repository = self.open_repository()
+
+		# Revisions by revision number, filled as they're read
+		self.revisions = None
+		self.changelog_index = None
+		# Filenodes with already known contents, which don't need to be read ahead
+		self.known_filenodes = {}
+		# See set_filters()
+		self.revision_filter = None
+		self.path_filter = None
+		self.revisions_needed = None
+		# Revisions converted by a previous run, see resume()
+		self.converted_revisions = None
+		return
+
+	### set_filters() sets predicates to skip the parts of history not needed for the conversion.
+	# revision_filter(rev, rev_id, branch) returns True if the revision is needed by itself
+	# (it's on a mapped branch, or it's a source or target of configured revision actions).
+	# The files are not read for revisions which are not needed, and have no needed descendants.
+	# The branch structure of such revisions is still read.
+	# path_filter(path) returns True if the path is not needed in any revision
+	def set_filters(self, revision_filter, path_filter):
+		self.revision_filter = revision_filter
+		self.path_filter = path_filter
+		return
+
+	def need_revision_files(self, rev):
+		return self.revisions_needed is None or self.revisions_needed[rev]
+
+	### make_revisions_needed() marks the revisions which are needed, and all their ancestors
+	def make_revisions_needed(self):
+		index = self.changelog_index
+		node = self.repository.changelog.node
+		revisions_needed = bytearray(index.count)
+		for rev in reversed(range(index.count)):
+			if not revisions_needed[rev] and \
+				self.revision_filter(rev, node(rev).hex(), index.branch_names[index.branch_ids[rev]]):
+				revisions_needed[rev] = 1
+			if revisions_needed[rev]:
+				for parent_rev in index.get_parents(rev):
+					revisions_needed[parent_rev] = 1
+			continue
+		return revisions_needed
+
+	def get_changelog_index(self):
+		if self.changelog_index is None:
+			self.changelog_index = hg_changelog_index(self.repository)
+		return self.changelog_index
+
+	def get_revision_nodes(self, count):
+		node = self.repository.changelog.node
+		return [node(rev) for rev in range(count)]
+
+	def get_converted_tags(self, nodes):
+		tags = self.changelog_index.tags
+		return {node : tags[node] for node in nodes if node in tags}
+
+	### get_resume_state() returns the state to resume reading in another run,
+	# after the first 'count' revisions have been converted.
+	# The state identifies the converted revisions, and keeps their tags
+	def get_resume_state(self, count):
+		self.get_changelog_index()
+		nodes = self.get_revision_nodes(count)
+		return {
+			'count' : count,
+			'total_count' : self.changelog_index.count,
+			'nodes_sha1' : hashlib.sha1(b''.join(nodes)).digest(),
+			'tags' : self.get_converted_tags(nodes),
+			}
+
+	### resume() sets up reading to start after the revisions converted by a previous run,
+	# from the state returned by get_resume_state().
+	# The state of the converted revisions, as their children see it, is rebuilt from the changelog index.
+	# Returns None, or the reason why reading cannot be resumed with the same result as reading from the start
+	def resume(self, state):
+		index = self.get_changelog_index()
+		count = state['count']
+		if count > index.count:
+			return "the repository has fewer revisions than converted before"
+		nodes = self.get_revision_nodes(count)
+		if hashlib.sha1(b''.join(nodes)).digest() != state['nodes_sha1']:
+			return "the converted revisions have been changed in the repository"
+		if self.get_converted_tags(nodes) != state['tags']:
+			return "the tags on the converted revisions have been changed"
+
+		# Number of children of each revision, as seen by the previous run
+		prev_children_count = array('I', [0]) * count
+		for rev in range(count):
+			for parent_rev in index.get_parents(rev):
+				prev_children_count[parent_rev] += 1
+			continue
+
+		# The children are linked and counted the same as by hg_changectx_revision
+		revisions = []
+		for rev in range(count):
+			revision = hg_converted_revision(rev, nodes[rev],
+						index.branch_names[index.branch_ids[rev]], index.children_count[rev])
+			revisions.append(revision)
+			parents = index.get_parents(rev)
+			if not parents:
+				continue
+			parent_revision = revisions[parents[0]]
+			if parent_revision.branch == revision.branch and parent_revision.child_revision is None:
+				parent_revision.child_revision = revision
+			else:
+				parent_revision.children_count -= 1
+				prev_children_count[parents[0]] -= 1
+			for parent_rev in parents[1:]:
+				parent_revision = revisions[parent_rev]
+				parent_revision.children_count -= 1
+				prev_children_count[parent_rev] -= 1
+				if prev_children_count[parent_rev] == 0 and parent_revision.children_count != 0:
+					# The previous run has ended the merged sub-branch here,
+					# but now the revision has more children to continue it
+					return "revision %d got new children after being merged" % parent_rev
+				continue
+			continue
+
+		# The previous run has released the trees of the converted revisions after converting all their children.
+		# The revisions added since then (from 'total_count') cannot be converted from such revision
+		total_count = state['total_count']
+		children_converted = bytearray(count)
+		children_pending = bytearray(count)
+		for rev in range(index.count):
+			for parent_rev in index.get_parents(rev):
+				if rev < count:
+					children_converted[parent_rev] = 1
+				elif parent_rev >= count:
+					continue
+				elif rev < total_count:
+					children_pending[parent_rev] = 1
+				elif children_converted[parent_rev] and not children_pending[parent_rev]:
+					return "revision %d got new children after its tree was released" % parent_rev
+				continue
+			continue
+
+		self.converted_revisions = revisions
+		return None
+
+	def open_repository(self):
 		from mercurial.localrepo import instance as hg_repository
 		from mercurial import ui
-		self.repository = hg_repository(ui.ui(), repository_directory.encode(), False)
+		return hg_repository(ui.ui(), self.repository_directory.encode(), False)
 
-		# Revisions by changectx node()
-		self.changectx_dict = {}
+	### read_revisions() generator yields hg_changectx_revision objects.
+	# With options.prefetch_depth, the file contents of this many following revisions
+	# are read ahead in a separate thread, while the current revision is being processed
+	def read_revisions(self, options):
+		prefetch_depth = getattr(options, 'prefetch_depth', 0)
+		if not prefetch_depth:
+			yield from self.read_changectx_revisions(options)
+			return
+
+		prefetcher = hg_prefetcher(self, getattr(options, 'prefetch_size', 256) * 0x100000)
+		pending_revisions = deque()
+		try:
+			for revision in self.read_changectx_revisions(options):
+				prefetcher.submit(revision)
+				pending_revisions.append(revision)
+				if len(pending_revisions) <= prefetch_depth:
+					continue
+				revision = pending_revisions.popleft()
+				prefetcher.wait(revision)
+				yield revision
+				prefetcher.release(revision)
+
+			while pending_revisions:
+				revision = pending_revisions.popleft()
+				prefetcher.wait(revision)
+				yield revision
+				prefetcher.release(revision)
+		finally:
+			prefetcher.shutdown()
 		return
 
-	def read_revisions(self, options):
-		rev = 0
-		pending_changectx_dict = {}
-		changes_array = [None] * len(self.repository.changelog)
-		# The mercurial repository seems to use a caching scheme with weak references
-		# We will keep references to the parents to make sure they will be reused
-		for change_idx in range(len(changes_array)):
-			t = changes_array[change_idx]
-			if t is None:
-				# This revision begins an orphan branch
-				changectx = self.repository[change_idx]
-				parents = []
-			else:
-				changectx = t[0]
-				# Drop the reference to the changeset in the array.
-				# If it stays alive, memory commit size balloons greatly
-				# and the program can run out of memory on a large repository
-				changes_array[change_idx] = None
+	### send_revisions() runs in the reader child process. It sends the serialized revisions
+	# to the pipe, together with the contents of file revisions not sent before.
+	def send_revisions(self, conn, options):
+		try:
+			for revision in self.read_revisions(options):
+				for node in revision.nodes:
+					data_source = node.data_source
+					if data_source is None or node.filenode in self.known_filenodes:
+						continue
+					data_source.prefetched = data_source()
+					self.known_filenodes[node.filenode] = True
+					continue
+				conn.send_bytes(pickle.dumps((b'revision', revision), protocol=pickle.HIGHEST_PROTOCOL))
+				for node in revision.nodes:
+					if node.data_source is not None:
+						node.data_source.prefetched = None
+				continue
+		except Exception:
+			conn.send_bytes(pickle.dumps((b'error', traceback.format_exc())))
+			return
+		conn.send_bytes(pickle.dumps((b'done', None)))
+		return
+
+	def read_changectx_revisions(self, options):
+		index = self.get_changelog_index()
+		self.revisions = [None] * index.count
+		start_rev = 0
+		if self.converted_revisions is not None:
+			start_rev = len(self.converted_revisions)
+			self.revisions[:start_rev] = self.converted_revisions
+		if self.revision_filter is not None:
+			self.revisions_needed = self.make_revisions_needed()
+
+		for rev in range(start_rev, index.count):
+			# The change context is only used to read the revision properties and files.
+			# The revision graph, branches and tags come from the changelog index
+			changectx = self.repository[rev]
 			revision = hg_changectx_revision(self, changectx, options)
-			self.changectx_dict[changectx.node()] = revision
+			self.revisions[rev] = revision
+			if self.path_filter is not None:
+				revision.nodes = [node for node in revision.nodes
+						if node.kind == b'branch' or not self.path_filter(node.path)]
 
 			yield revision
-			rev += 1
-
-			# Process the child revisions
-			for child_ctx in changectx.children():
-				node= child_ctx.node()
-				if node in pending_changectx_dict:
-					child_ctx, parents, pending_parents = pending_changectx_dict[node]
-					# The mercurial repository returns same cached object when requested by node or rev
-					pending_parents.remove(changectx)
-					if not pending_parents:
-						pending_changectx_dict.pop(node)
-				else:
-					parents = [*child_ctx.parents()]
-					pending_parents = parents.copy()
-					pending_parents.remove(changectx)
-
-				if pending_parents:
-					pending_changectx_dict[node] = (child_ctx, parents, pending_parents)
-					continue
-				# Also keep references to its parents, to keep them cached
-				changes_array[child_ctx.rev()] = (child_ctx, parents)
 			continue
 
 		return
 
+def run_reader_process(reader_type, repository_directory, conn, options, known_filenodes, resume_state):
+	reader = reader_type(repository_directory)
+	reader.known_filenodes = known_filenodes
+	try:
+		if resume_state is not None:
+			# Already checked by the parent process
+			reader.resume(resume_state)
+		reader.send_revisions(conn, options)
+	finally:
+		conn.close()
+	return
+
+### hg_process_reader runs the Mercurial repository reader in a child process,
+# which sends the revisions, serialized with pickle, through a pipe.
+# Thus, reading Mercurial history and the conversion don't compete for the same GIL.
+# The file contents not seen before are sent along with the revision.
+# The repository handle of this process is only used to read the contents again, if needed
+class hg_process_reader(hg_repository_reader):
+	# This reader type is created in the child process
+	READER_TYPE = hg_repository_reader
+	# The state passed to the child process, to resume reading
+	resume_state = None
+
+	def resume(self, state):
+		reason = super().resume(state)
+		if reason is None:
+			# The child process rebuilds the converted revisions itself
+			self.resume_state = state
+		return reason
+
+	def read_revisions(self, options):
+		reader_options = SimpleNamespace(
+			convert_hgignore=options.convert_hgignore,
+			convert_hgeol=options.convert_hgeol,
+			prefetch_depth=getattr(options, 'prefetch_depth', 0),
+			prefetch_size=getattr(options, 'prefetch_size', 256))
+
+		context = multiprocessing.get_context('spawn')
+		conn, child_conn = context.Pipe(duplex=False)
+		process = context.Process(target=run_reader_process, name='hg_reader', daemon=True,
+					args=(self.READER_TYPE, self.repository_directory, child_conn,
+						reader_options, dict.fromkeys(self.known_filenodes, True), self.resume_state))
+		process.start()
+		child_conn.close()
+
+		# The converted revisions are parents of the revisions read after them
+		revision_dict = {}
+		if self.converted_revisions is not None:
+			revision_dict = {revision.rev_id : revision for revision in self.converted_revisions}
+		try:
+			while True:
+				try:
+					kind, payload = pickle.loads(conn.recv_bytes())
+				except EOFError:
+					raise Exception_history_parse("Mercurial reader process terminated unexpectedly")
+				if kind == b'error':
+					raise Exception_history_parse("Mercurial reader process failed:\n%s" % payload)
+				if kind == b'done':
+					break
+
+				revision = payload
+				revision.attach(revision_dict, self.repository)
+				revision_dict[revision.rev_id] = revision
+				yield revision
+
+				# Release the contents not consumed
+				for node in revision.nodes:
+					if node.data_source is not None:
+						node.data_source.prefetched = None
+				continue
+		finally:
+			conn.close()
+			if process.is_alive():
+				process.terminate()
+			process.join()
+		return
+
 def print_stats(fd):
+	print("Mercurial file contents read: %d, %d MiB" % (TOTAL_FILES_READ, TOTAL_BYTES_READ//0x100000), file=fd)
+	if TOTAL_FILES_PREFETCHED:
+		print("Mercurial file contents read ahead: %d, %d MiB" % (TOTAL_FILES_PREFETCHED, TOTAL_BYTES_PREFETCHED//0x100000), file=fd)
 	return
@@ -0,0 +1,167 @@
+#   Copyright 2023 Alexandre Grigoriev
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+### This module writes the sequence of revisions read from a Mercurial repository
+# to a stream file, and replays it without Mercurial.
+# The file begins with STREAM_SIGNATURE, followed by records.
+# Each record is: 1 byte record type, 8 bytes big-endian payload length, and the payload:
+# b'H' - header: pickled dictionary of options which affect the revisions
+# b'B' - file contents. Identical contents are only written once
+# b'R' - pickled hg_changectx_revision. The file data sources refer to b'B' records
+# by their payload offset and length.
+# The file is mapped to memory for the replay, and the contents are only read when needed.
+
+import io
+import mmap
+import struct
+import pickle
+import hashlib
+
+from exceptions import Exception_history_parse
+from hg_reader import hg_file_data
+
+STREAM_SIGNATURE = b'HG-TO-GIT STREAM 1\n'
+RECORD_HEADER = struct.Struct('>cQ')
+
+# These options affect the revisions, and must be same for the dump and the replay
+STREAM_OPTIONS = ('convert_hgignore', 'convert_hgeol')
+
+def get_stream_options(options):
+	return {name : getattr(options, name, False) for name in STREAM_OPTIONS}
+
+### hg_stream_data loads the file contents from the memory-mapped stream file, when called
+class hg_stream_data:
+	__slots__ = ('buffer', 'offset', 'length')
+
+	def __init__(self, buffer, offset, length):
+		self.buffer = buffer
+		self.offset = offset
+		self.length = length
+		return
+
+	def __call__(self):
+		return self.buffer[self.offset:self.offset + self.length]
+
+### The pickler replaces the file data sources with the location of their contents in the stream
+class stream_pickler(pickle.Pickler):
+	def __init__(self, file, filenode_blobs):
+		super().__init__(file, protocol=pickle.HIGHEST_PROTOCOL)
+		self.filenode_blobs = filenode_blobs
+		return
+
+	def persistent_id(self, obj):
+		if type(obj) is hg_file_data:
+			return self.filenode_blobs[obj.filenode]
+		return None
+
+class stream_unpickler(pickle.Unpickler):
+	def __init__(self, file, buffer):
+		super().__init__(file)
+		self.buffer = buffer
+		return
+
+	def persistent_load(self, pid):
+		offset, length = pid
+		return hg_stream_data(self.buffer, offset, length)
+
+### hg_stream_writer passes through the revisions from another reader,
+# and writes them to the stream file
+class hg_stream_writer:
+	def __init__(self, reader, filename):
+		self.reader = reader
+		self.filename = filename
+		self.known_filenodes = {}
+		return
+
+	def write_record(self, fd, record_type, payload):
+		fd.write(RECORD_HEADER.pack(record_type, len(payload)))
+		offset = fd.tell()
+		fd.write(payload)
+		return offset, len(payload)
+
+	def read_revisions(self, options):
+		self.reader.known_filenodes = self.known_filenodes
+		# Contents locations, keyed by contents SHA1
+		blobs = {}
+		# Contents locations, keyed by filenode
+		filenode_blobs = {}
+
+		with open(self.filename, 'wb') as fd:
+			fd.write(STREAM_SIGNATURE)
+			self.write_record(fd, b'H', pickle.dumps(get_stream_options(options)))
+
+			for revision in self.reader.read_revisions(options):
+				for node in revision.nodes:
+					data_source = node.data_source
+					if data_source is None or node.filenode in filenode_blobs:
+						continue
+					data = data_source()
+					# Pass the contents to the consumer, to avoid reading them again
+					data_source.prefetched = data
+					h = hashlib.sha1(data).digest()
+					blob = blobs.get(h)
+					if blob is None:
+						blob = self.write_record(fd, b'B', data)
+						blobs[h] = blob
+					filenode_blobs[node.filenode] = blob
+					continue
+
+				payload = io.BytesIO()
+				stream_pickler(payload, filenode_blobs).dump(revision)
+				self.write_record(fd, b'R', payload.getbuffer())
+
+				yield revision
+
+				for node in revision.nodes:
+					if node.data_source is not None:
+						node.data_source.prefetched = None
+				continue
+		return
+
+### hg_stream_reader replays the revisions from a stream file.
+# It has the same read_revisions() interface as hg_repository_reader
+class hg_stream_reader:
+	def __init__(self, filename):
+		self.filename = filename
+		self.known_filenodes = {}
+		return
+
+	def read_revisions(self, options):
+		with open(self.filename, 'rb') as fd:
+			buffer = mmap.mmap(fd.fileno(), 0, access=mmap.ACCESS_READ)
+
+		if buffer[:len(STREAM_SIGNATURE)] != STREAM_SIGNATURE:
+			raise Exception_history_parse('File "%s" is not a revision stream file' % self.filename)
+
+		revision_dict = {}
+		pos = len(STREAM_SIGNATURE)
+		while pos < len(buffer):
+			record_type, length = RECORD_HEADER.unpack_from(buffer, pos)
+			pos += RECORD_HEADER.size
+			if pos + length > len(buffer):
+				raise Exception_history_parse('Revision stream file "%s" is truncated' % self.filename)
+
+			if record_type == b'R':
+				revision = stream_unpickler(io.BytesIO(buffer[pos:pos + length]), buffer).load()
+				revision.attach(revision_dict, None)
+				revision_dict[revision.rev_id] = revision
+				yield revision
+			elif record_type == b'H':
+				stream_options = pickle.loads(buffer[pos:pos + length])
+				if stream_options != get_stream_options(options):
+					raise Exception_history_parse('Revision stream file "%s" was written with different options: %s'
+						% (self.filename, ', '.join('%s=%s' % item for item in stream_options.items())))
+			pos += length
+			continue
+		return
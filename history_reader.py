@@ -14,13 +14,25 @@
 
 import sys
 import time
+import weakref
 import datetime
 from exceptions import Exception_history_parse
 import re
 import hashlib
+from blob_store import content_store, stored_content
+import threading
+from collections import OrderedDict
 
+# Maximum total number of records kept by the tree comparison cache
+TREE_DIFF_CACHE_SIZE = 0x10000
+
+TOTAL_TREE_DIFF_LOOKUPS = 0
+TOTAL_TREE_DIFF_HITS = 0
+
+### make_data_sha1() returns hashlib SHA1 object of the data, hashed as Git blob.
+# Its digest is then the same as Git blob ID, if the blob needs no conversion when written to Git
 def make_data_sha1(data):
-	h = hashlib.sha1()
+	h = hashlib.sha1(b'blob %d\0' % len(data))
 	h.update(data)
 	return h
 
@@ -39,7 +51,29 @@ def apply_delta_to_properties(props, delta):
 			props[key] = data
 	return props
 
+### frozen_dict is a read-only dictionary.
+# The properties and attributes of tree objects are never modified in place, but replaced.
+# This allows the copies of an object to share them, and all objects without them to share EMPTY_MAP
+class frozen_dict(dict):
+	__slots__ = ()
+
+	def readonly(self, *args, **kwargs):
+		raise TypeError("frozen_dict cannot be modified")
+
+	__setitem__ = __delitem__ = __ior__ = clear = pop = popitem = setdefault = update = readonly
+
+EMPTY_MAP = frozen_dict()
+
+### copy_map() returns a copy of the properties or attributes dictionary, to be kept by a tree object
+def copy_map(src):
+	if not src:
+		return EMPTY_MAP
+	return src.copy()
+
 class base_tree_object:
+	# The objects are referred by the weak-valued obj_dictionary
+	__slots__ = ('object_sha1', 'hidden', 'properties', '__weakref__')
+
 	def __init__(self, src = None, properties=None):
 		# object_sha1 is calculated in different way, depending on the object type. This is 'bytes' object.
 		self.object_sha1 = None
@@ -48,13 +82,11 @@ class base_tree_object:
 		if src is not None:
 			self.hidden = src.hidden
 			if properties is not None:
-				self.properties = properties.copy()
+				self.properties = copy_map(properties)
 			else:
-				self.properties = src.properties.copy()
-		elif properties:
-			self.properties = properties.copy()
+				self.properties = src.properties
 		else:
-			self.properties = {}
+			self.properties = copy_map(properties)
 
 		return
 
@@ -85,7 +117,7 @@ class base_tree_object:
 			return self
 
 		self = self.make_unshared()
-		self.properties = props.copy()
+		self.properties = copy_map(props)
 
 		return self
 
@@ -176,17 +208,22 @@ class base_tree_object:
 # identical SHA1 refer to the same data blob object,
 #  which is also kept as object_blob, but with empty attributes and properties
 class object_blob(base_tree_object):
+	__slots__ = ('data', 'data_source', 'data_len', 'data_sha1')
+
 	def __init__(self, src = None, properties=None):
 		super().__init__(src, properties)
 		if src:
 			# data may not be present
 			self.data = src.data
+			# data_source is a callable to load the data on demand, if it's not present
+			self.data_source = src.data_source
 			# keep the length, because we may not be keeping the bytes of blob itself
 			self.data_len = src.data_len
-			# this is sha1 of data only, as 40 chars hex string.
+			# this is Git blob SHA1 of data only, as 20 bytes digest.
 			self.data_sha1 = src.data_sha1
 		else:
 			self.data = None
+			self.data_source = None
 			self.data_len = 0
 			self.data_sha1 = None
 		return
@@ -194,6 +231,22 @@ class object_blob(base_tree_object):
 	def is_file(self):
 		return True
 
+	### get_data() returns the blob bytes, loading them from data_source, if they're not present
+	def get_data(self):
+		data = self.data
+		if data is None and self.data_source is not None:
+			data = self.data_source()
+		return data
+
+	### release_data() drops the blob bytes, if they can be loaded again
+	def release_data(self):
+		data_source = self.data_source
+		if data_source is not None:
+			self.data = None
+			if type(data_source) is stored_content:
+				data_source.release()
+		return
+
 	def __str__(self, prefix=''):
 		return prefix
 
@@ -203,26 +256,31 @@ class object_blob(base_tree_object):
 		# b'BLOB', then length as decimal string, terminated with '\n', then 20 bytes of data hash in binary form
 		# This avoids running sha1 on data twice.
 		# Also, it includes hashes of attribute key:value pairs of self.attributes dictionary
-		return super().make_object_hash(b'BLOB %d\n%s' % (len(self.data), self.data_sha1))
+		return super().make_object_hash(b'BLOB %d\n%s' % (self.data_len, self.data_sha1))
 
 ### This object describes a directory, similar to Git tree object
 # It's identified by its specific SHA1, calculated over hashes of items, and also over its attributes
 # Two trees with identical files but different attributes will have different hash values
 class object_tree(base_tree_object):
+	__slots__ = ('items', 'dict')
+
 	def __init__(self, src = None, properties=None):
 		super().__init__(src, properties)
-		# items are object_tree.item instances
+		# dict keeps object_tree.item instances, keyed by name.
+		# The sorted tuple of items is only made by finalize(). Until then, the tree is modified in place
+		self.items = None
 		if src:
-			self.items = src.items.copy()
 			self.dict = src.dict.copy()
 		else:
-			self.items = []
 			self.dict = {}
 		return
 
 	class item:
+		__slots__ = ('name', 'object')
+
 		def __init__(self, name, obj=None):
-			self.name = name
+			# Same names in many trees share one string
+			self.name = sys.intern(name)
 			self.object = obj
 			return
 
@@ -244,9 +302,10 @@ class object_tree(base_tree_object):
 	def is_dir(self):
 		return True
 
+	### finalize() sorts the items and finalizes the modified subtrees bottom-up, before hashing the tree
 	def finalize(self, dictionary):
 		if not self.is_finalized():
-			self.items.sort(key=lambda t : t.name)
+			self.items = tuple(sorted(self.dict.values(), key=lambda t : t.name))
 			for item in self.items:
 				item.object = item.object.finalize(dictionary)
 		return super().finalize(dictionary)
@@ -268,8 +327,9 @@ class object_tree(base_tree_object):
 			return self
 
 		self = super().hide(hide)
-		for item in self.items:
-			item.object = item.object.hide(hide)
+		# The items are shared with the original tree, and are replaced
+		for item in list(self.dict.values()):
+			self.dict[item.name] = self.item(item.name, item.object.hide(hide))
 		return self
 
 	def set(self, path : str, obj, **kwargs):
@@ -284,25 +344,25 @@ class object_tree(base_tree_object):
 			else:
 				t = t.object
 			obj = t.set(split[2], obj, **kwargs)
-
-		if old_item is not None and not kwargs \
-			and old_item.object.object_sha1 is not None \
-			and old_item.object.object_sha1 == obj.object_sha1:
-			# no changes
-			return self
+			# Item attributes only apply to the last path component
+			kwargs = {}
+
+		if old_item is not None and not kwargs:
+			if old_item.object is obj and not obj.is_finalized():
+				# The subtree has been modified in place
+				return self
+			if old_item.object.object_sha1 is not None \
+				and old_item.object.object_sha1 == obj.object_sha1:
+				# no changes
+				return self
 
 		self = self.make_unshared()
 
-		if old_item is not None:
-			self.items.remove(old_item)
-
 		if self.hidden and not obj.hidden:
 			# Objects set to a hidden directory become hidden, too
 			obj = obj.hide()
 
-		new_item = self.item(split[0], obj, **kwargs)
-		self.items.append(new_item)
-		self.dict[split[0]] = new_item
+		self.dict[split[0]] = self.item(split[0], obj, **kwargs)
 		return self
 
 	### find_path(path) finds a tree item (a file or directory) by its path
@@ -337,10 +397,8 @@ class object_tree(base_tree_object):
 		if old_item is None:
 			return None		# no changes
 
-		self = self.make_unshared()
-
 		if not split[2]:
-			self.items.remove(old_item)
+			self = self.make_unshared()
 			self.dict.pop(split[0])
 			return self
 
@@ -353,20 +411,18 @@ class object_tree(base_tree_object):
 		if not new_subtree:
 			return None
 
-		self.items.remove(old_item)
+		self = self.make_unshared()
+
 		if len(new_subtree.dict) == 0:
 			# Delete a leftover empty directory
 			self.dict.pop(split[0])
-			return self
-
-		new_item = self.item(split[0], new_subtree)
-		self.items.append(new_item)
-		self.dict[split[0]] = new_item
+		elif new_subtree is not old_item.object:
+			self.dict[split[0]] = self.item(split[0], new_subtree)
 		return self
 
 	### makes the tree into a printable string
 	def __str__(self, prefix=''):
-		return prefix + '/\n' + '\n'.join((item.object.__str__(prefix + '/' + item.name) for item in self.items))
+		return prefix + '/\n' + '\n'.join((item.object.__str__(prefix + '/' + item.name) for item in self.dict.values()))
 
 	### The function compares two "finalized" trees (with object hashes calculated),
 	# and returns differences as a list of tuples in format:
@@ -378,7 +434,9 @@ class object_tree(base_tree_object):
 	# unless expand_dir_contents is True, in which case all contents of the unmatched directory
 	# is also reported in the result
 	# Same path but different types are reported as first erase then add
-	def compare(tree1, tree2, path_prefix : str="", expand_dir_contents = True, item1=None,item2=None):
+	# If 'diff_cache' (tree_diff_cache) is given, the differences of each pair of subtrees are taken from it, or cached there.
+	# Otherwise, the differences are generated while the trees are walked, without making lists of them
+	def compare(tree1, tree2, path_prefix : str="", expand_dir_contents = True, item1=None,item2=None, diff_cache=None):
 		if (tree1 is not None and not tree1.is_finalized()) or (tree2 is not None and not tree2.is_finalized()):
 			raise Exception_history_parse("Non-finalized trees passed to compare_trees function")
 
@@ -388,6 +446,11 @@ class object_tree(base_tree_object):
 
 		yield (path_prefix, tree1, tree2, item1,item2)
 
+		if diff_cache is not None:
+			yield from object_tree.iterate_diff_records(
+				diff_cache.get(tree1, tree2, expand_dir_contents), path_prefix)
+			return
+
 		if tree1 is not None:
 			assert(tree2 is None or tree1 == tree2 or tree1.object_sha1 != tree2.object_sha1)
 			iter1 = iter(tree1.items)
@@ -459,6 +522,89 @@ class object_tree(base_tree_object):
 
 		return
 
+	### iterate_diff_records() makes the tuples returned by compare() from the cached records
+	def iterate_diff_records(records, path_prefix):
+		for name, obj1, obj2, item1, item2, subtree_records in records:
+			path = path_prefix + name
+			yield (path, obj1, obj2, item1, item2)
+			if subtree_records is not None:
+				yield from object_tree.iterate_diff_records(subtree_records, path)
+			continue
+		return
+
+	### compare_items() returns the list of records for differences of the items of two trees,
+	# as (name, obj1, obj2, item1, item2, subtree_records).
+	# For a directory, name ends with '/', and subtree_records is the list of records
+	# for the directory contents, or None if the contents are not reported
+	def compare_items(tree1, tree2, expand_dir_contents, diff_cache):
+		records = []
+
+		if tree1 is not None:
+			assert(tree2 is None or tree1 == tree2 or tree1.object_sha1 != tree2.object_sha1)
+			iter1 = iter(tree1.items)
+		else:
+			iter1 = None
+
+		if tree2 is not None:
+			iter2 = iter(tree2.items)
+		else:
+			iter2 = None
+		item1 = None
+		item2 = None
+
+		# The tree items are sorted by names in object_tree.finalize()
+		while True:
+			# item1 is set to None when consumed
+			if item1 is None and iter1 is not None:
+				item1 = next(iter1, None)
+				if item1 is not None:
+					obj1 = item1.object
+				elif iter2 is None:
+					break
+
+			# item2 is set to None when consumed
+			if item2 is None and iter2 is not None:
+				item2 = next(iter2, None)
+				if item2 is not None:
+					obj2 = item2.object
+				elif item1 is None:
+					break
+
+			if item1 is None or item2 is not None and item1.name > item2.name:
+
+				if obj2.is_dir():
+					records.append((item2.name + '/', None, obj2, None, item2,
+						diff_cache.get(None, obj2, True) if expand_dir_contents else None))
+				else:
+					records.append((item2.name, None, obj2, None, item2, None))
+				item2 = None
+				continue
+
+			if item2 is None or item1 is not None and (
+				item2.name > item1.name or obj1.is_dir() != obj2.is_dir()):
+
+				if obj1.is_dir():
+					records.append((item1.name + '/', obj1, None, item1, None,
+						diff_cache.get(obj1, None, True) if expand_dir_contents else None))
+				else:
+					records.append((item1.name, obj1, None, item1, None, None))
+				item1 = None
+				continue
+
+			# Names and types of items are identical here
+			if obj1.object_sha1 == obj2.object_sha1:
+				pass
+			elif obj1.is_file():
+				records.append((item1.name, obj1, obj2, item1, item2, None))
+			else:
+				records.append((item1.name + '/', obj1, obj2, item1, item2,
+					diff_cache.get(obj1, obj2, expand_dir_contents)))
+
+			item1 = None
+			item2 = None
+
+		return records
+
 	class diffs_metrics:
 		def __init__(self, identical, different, deleted, added):
 			self.identical = identical	# Number of identical files
@@ -546,6 +692,87 @@ class object_tree(base_tree_object):
 
 		return object_tree.diffs_metrics(identical_files, different_files, deleted_files, added_files)
 
+### tree_diff_cache keeps the results of object_tree.compare_items() for pairs of trees,
+# keyed by the trees' SHA1 and expand_dir_contents flag, in least recently used order.
+# The records of a directory refer to the cached list of its contents, thus the lists are shared
+# by the results of parent trees. A result refers to its trees weakly, to not keep the trees
+# released by their revisions. When either tree is deleted, the result is dropped,
+# together with the references to the tree items in the records.
+# A result is only used if its trees are the same objects as compared, because the records refer to their items.
+# The total number of records kept is limited by max_size
+class tree_diff_cache:
+	def __init__(self, max_size):
+		self.max_size = max_size
+		self.size = 0
+		# Values are tuples of (tree1 reference, tree2 reference, records)
+		self.results = OrderedDict()
+		# Keys of the results with deleted trees, appended by weak reference callbacks.
+		# They're dropped by the next get()
+		self.dead_keys = []
+		# The trees are compared in the main thread and in the commit threads
+		self.lock = threading.Lock()
+		return
+
+	def get(self, tree1, tree2, expand_dir_contents):
+		global TOTAL_TREE_DIFF_LOOKUPS, TOTAL_TREE_DIFF_HITS
+		key = (tree1.object_sha1 if tree1 is not None else None,
+			tree2.object_sha1 if tree2 is not None else None,
+			expand_dir_contents)
+		with self.lock:
+			self.drop_dead_results()
+			TOTAL_TREE_DIFF_LOOKUPS += 1
+			result = self.results.get(key)
+			if result is not None and result[0]() is tree1 and result[1]() is tree2:
+				self.results.move_to_end(key)
+				TOTAL_TREE_DIFF_HITS += 1
+				return result[2]
+
+		# The subtrees are compared without holding the lock
+		records = object_tree.compare_items(tree1, tree2, expand_dir_contents, self)
+
+		with self.lock:
+			result = self.results.pop(key, None)
+			if result is not None:
+				self.size -= len(result[2]) + 1
+			self.results[key] = (self.make_ref(tree1, key), self.make_ref(tree2, key), records)
+			# An empty result is counted as one record
+			self.size += len(records) + 1
+			while self.size > self.max_size:
+				key, result = self.results.popitem(last=False)
+				self.size -= len(result[2]) + 1
+				continue
+		return records
+
+	def make_ref(self, tree, key):
+		if tree is None:
+			return no_tree
+		# The callback can be called in any thread, even while the lock is held
+		return weakref.ref(tree, lambda ref: self.dead_keys.append(key))
+
+	def drop_dead_results(self):
+		while self.dead_keys:
+			key = self.dead_keys.pop()
+			result = self.results.get(key)
+			if result is None:
+				continue
+			# The key may have been reused for a result with new trees
+			if (key[0] is not None and result[0]() is None) \
+					or (key[1] is not None and result[1]() is None):
+				del self.results[key]
+				self.size -= len(result[2]) + 1
+			continue
+		return
+
+### no_tree() is used as the reference for a missing tree in tree_diff_cache results
+def no_tree():
+	return None
+
+def print_stats(fd):
+	if TOTAL_TREE_DIFF_LOOKUPS:
+		print("Tree comparisons: %d, served from cache: %d%%" % (
+			TOTAL_TREE_DIFF_LOOKUPS, TOTAL_TREE_DIFF_HITS * 100 // TOTAL_TREE_DIFF_LOOKUPS), file=fd)
+	return
+
 ### The function pretty-prints the list returned by object_tree.compare() function
 def print_diff(diff_list, fd):
 	if len(diff_list) == 0:
@@ -574,6 +801,10 @@ class history_revision:
 		self.rev = hg_revision.rev
 		self.rev_id = hg_revision.rev_id
 		self.prev_rev = prev_revision
+		# Number of Mercurial children not applied yet. When it drops to zero,
+		# the revision can't be a parent anymore, and its tree is released.
+		# None if the reader doesn't tell the number of children
+		self.pending_children = getattr(hg_revision, 'total_children', None)
 		return
 
 class history_reader:
@@ -585,7 +816,19 @@ class history_reader:
 		self.revision_dict = {}	# To index revisions by revision ID (for alternate source control systems)
 		self.last_rev = None
 		self.head = None
-		self.obj_dictionary = {}
+		# Finalized objects, keyed by their SHA1. The objects are only kept while referred by a revision tree.
+		# This allows the trees of released revisions and their unique subtrees and blobs to be reclaimed
+		self.obj_dictionary = weakref.WeakValueDictionary()
+		# Revisions (by number or ID) to keep the tree of, because they are copy sources for the configured actions
+		self.pinned_revisions = set()
+		# Data length and SHA1 of file contents, keyed by the node's filenode,
+		# to make blobs of already seen contents without reading them again
+		self.filenode_dict = {}
+		# The contents of blobs are kept by the content store, within the memory budget
+		blob_memory_size = getattr(options, 'blob_memory_size', None)
+		self.content_store = content_store(blob_memory_size * 0x100000 if blob_memory_size is not None else None)
+		# The results of comparing the trees
+		self.diff_cache = tree_diff_cache(TREE_DIFF_CACHE_SIZE)
 		self.empty_tree = self.finalize_object(self.TREE_TYPE())
 		self.options = options
 		self.quiet = getattr(options, 'quiet', False)
@@ -620,7 +863,9 @@ class history_reader:
 
 	def apply_revision(self, revision):
 		# Apply the revision to the previous revision.
-		# go through nodes in the revision, and apply the action to the history streams
+		# go through nodes in the revision, and apply the action to the history streams.
+		# The directories changed by the revision are copied from the previous tree only once,
+		# then modified in place, and hashed by a single finalize_object() call
 		for node in revision.hg_revision.nodes:
 			try:
 				revision.tree = self.apply_node(node, revision.tree)
@@ -633,10 +878,47 @@ class history_reader:
 				e.strerror = strerror + '\n' + e.strerror
 				raise
 
+		self.apply_revision_actions(revision)
+
 		revision.tree = self.finalize_object(revision.tree)
 
 		return revision
 
+	### apply_revision_actions() applies the changes not coming from the revision nodes,
+	# to the tree not finalized yet. A derived class overrides it
+	def apply_revision_actions(self, revision):
+		return
+
+	### release_parent_revisions() is called after the revision has been applied.
+	# The trees of its parents which have no more children to apply are released
+	def release_parent_revisions(self, hg_revision):
+		parent_rev_ids = []
+		if hg_revision.parent_revision is not None:
+			parent_rev_ids.append(hg_revision.parent_revision.rev_id)
+		for node in hg_revision.nodes:
+			if node.kind == b'branch' and (node.action == b'add' or node.action == b'parent') \
+					and node.copyfrom_rev is not None:
+				parent_rev_ids.append(node.copyfrom_rev)
+			continue
+
+		for rev_id in parent_rev_ids:
+			parent_revision = self.revision_dict.get(rev_id)
+			if parent_revision is None or not parent_revision.pending_children:
+				continue
+			parent_revision.pending_children -= 1
+			if parent_revision.pending_children == 0:
+				self.release_revision(parent_revision)
+			continue
+		return
+
+	### release_revision() drops the tree of a revision which can't be a copy source anymore,
+	# unless it's pinned by a configured action. A derived class can release more state of the revision
+	def release_revision(self, revision):
+		if revision.rev in self.pinned_revisions or revision.rev_id in self.pinned_revisions:
+			return
+		revision.tree = None
+		return
+
 	def get_revision(self, rev):
 		if type(rev) is not int:
 			# rev is an alternate ID
@@ -681,7 +963,8 @@ class history_reader:
 				if not subtree.is_dir():
 					raise Exception_history_parse('Directory copy source "%s" in rev %s is not a directory' % (node.copyfrom_path, copy_source_rev.rev_id))
 
-				subtree = subtree.copy()
+				# A directory changed by this revision gets finalized before it's shared by the copy
+				subtree = self.finalize_object(subtree).copy()
 				subtree = subtree.hide(False)
 
 		if node.props is not None:
@@ -710,7 +993,7 @@ class history_reader:
 			return base_tree.delete(node.path)
 
 		if node.action == b'hide':
-			return base_tree.set(node.path, file_blob.hide())
+			return self.set_file(base_tree, node.path, file_blob.hide())
 
 		if node.copyfrom_path is not None:
 			copy_source_rev = self.get_revision(node.copyfrom_rev)
@@ -726,17 +1009,19 @@ class history_reader:
 			source_file = source_file.hide(False)
 
 		text_content = node.text_content
+		# With data_source, the contents are loaded on demand
+		has_content = text_content is not None or node.data_source is not None
 
 		if node.action == b'change':
 			# 'change' operation preserves the original file instead of copying properties from the source
 			new_properties = file_blob.properties
-		elif text_content is not None and source_file:
+		elif has_content and source_file:
 			new_properties = source_file.properties
 
 		if node.props is not None:
 			new_properties = node.props
 
-		if text_content is not None:
+		if has_content:
 			file_blob = self.make_blob(text_content, node, new_properties)
 		else:
 			if source_file:
@@ -744,20 +1029,37 @@ class history_reader:
 			if new_properties is not None:
 				file_blob = self.copy_blob(file_blob, node, new_properties)
 
-		return base_tree.set(node.path, self.finalize_object(file_blob))
+		return self.set_file(base_tree, node.path, self.finalize_object(file_blob))
+
+	### set_file() puts the file object to the tree.
+	# A derived class overrides it to set the item attributes
+	def set_file(self, base_tree, path, obj):
+		return base_tree.set(path, obj)
 
 	def make_blob(self, data, node, properties):
 		# node.path can be used by a hook to apply proper path-specific Git attributes
 		# Make a bare object_blob for the given data, or use an existing clone
 
 		obj = self.BLOB_TYPE(properties=properties)
-		obj.data_len = len(data)
-		obj.data = data
-
-		obj.data_sha1 = make_data_sha1(data).digest()
+		if data is None:
+			# The data is read from node.data_source only if its filenode has not been seen before.
+			# The store can then drop the data, and read it again when needed
+			source = node.data_source
+			data_info = self.filenode_dict.get(node.filenode)
+			if data_info is None:
+				data = source()
+				data_info = (len(data), make_data_sha1(data).digest())
+				self.filenode_dict[node.filenode] = data_info
+			obj.data_len, obj.data_sha1 = data_info
+		else:
+			source = None
+			obj.data_len = len(data)
+			obj.data_sha1 = make_data_sha1(data).digest()
+		# The blobs with same contents share them in the content store
+		obj.data_source = self.content_store.add(obj.data_sha1, data, source)
 
 		if properties is not None:
-			obj.properties = properties.copy()
+			obj.properties = copy_map(properties)
 
 		# finalize will calculate object hash and possibly
 		# return an existing object instead of the one we just created
@@ -847,8 +1149,11 @@ class history_reader:
 		self.last_progress_time = 0.
 		self.start_time = time.monotonic()
 
-		prev_revision = None
+		# When the conversion is resumed, the revisions converted before are already present
+		prev_revision = self.HEAD()
 		rev = None
+		# The reader doesn't need to read ahead the contents of these filenodes
+		revision_reader.known_filenodes = self.filenode_dict
 		try:
 			for hg_revision in revision_reader.read_revisions(self.options):
 				rev = hg_revision.rev
@@ -873,12 +1178,14 @@ class history_reader:
 				self.total_revisions += 1
 
 				if log_revs:
-					diffs = [*old_tree.compare(revision.tree, expand_dir_contents=True)]
+					diffs = [*old_tree.compare(revision.tree, expand_dir_contents=True, diff_cache=self.diff_cache)]
 					if len(diffs):
 						print("Comparing with previous revision:", file=log_file)
 						print_diff(diffs, log_file)
 						print("", file=log_file)
 
+				self.release_parent_revisions(hg_revision)
+
 				if end_revision is not None and rev >= end_revision:
 					break
 
@@ -796,6 +796,7 @@ class history_revision_action:
 		self.copyfrom_path = copyfrom_path
 		self.copyfrom_rev = copyfrom_rev
 		self.text_content = text_content
+		self.data_source = None
 		return
 
 class project_config:
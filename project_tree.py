@@ -17,23 +17,36 @@ from typing import Iterator
 
 import io
 import os
+import asyncio
 import re
+import pickle
+import weakref
 from pathlib import Path
 import shutil
 import json
 from types import SimpleNamespace
 import git_repo
+import blob_store
 import hashlib
 from exceptions import Exception_history_parse, Exception_cfg_parse
 import concurrent.futures
 
 from history_reader import *
+from history_reader import print_stats as print_history_stats
 from lookup_tree import *
 from rev_ranges import *
 from dependency_node import *
+from git_index import index_tree, EMPTY_INDEX_TREE, write_index_file
+from collections import OrderedDict
 import project_config
 import format_files
 
+# Default number of index files kept by each branch for staging bases, see --index-pool-size
+DEFAULT_INDEX_POOL_SIZE = 4
+
+# Format version of the conversion state file, see --state-file
+STATE_FILE_VERSION = 4
+
 TOTAL_FILES_REFORMATTED = 0
 TOTAL_BYTES_IN_FILES_REFORMATTED = 0
 
@@ -110,6 +123,8 @@ class project_branch_rev(async_workitem):
 		self.commit = None
 		self.rev_commit = None
 		self.staged_git_tree = None
+		# staged_index is the snapshot of the staged tree (git_index.index_tree)
+		self.staged_index:index_tree = None
 		self.committed_git_tree = None
 		self.committed_tree = None
 		self.staged_tree:git_tree = None
@@ -144,6 +159,14 @@ class project_branch_rev(async_workitem):
 		self.props_list = []
 		self.tags = None
 		self.change_id = None
+		# Parent revision dropped from self.parents by a fast forward merge
+		self.fast_forward_rev = None
+		# Number of history revisions referring to this revision, which can still be merged from
+		self.history_refs = 0
+		# Number of revisions not completed yet, which have this revision as a parent or a staging base
+		self.tree_users = 0
+		# Set by release_trees(). The trees of a released revision must not be used anymore
+		self.released = False
 		return
 
 	def set_revision(self, revision):
@@ -166,6 +189,43 @@ class project_branch_rev(async_workitem):
 
 		return self
 
+	### The conversion state is saved without the links to the next revisions,
+	# to avoid recursing through the whole chain. project_history_tree.load_state() restores them
+	def __getstate__(self):
+		state = self.__dict__.copy()
+		state['next_rev'] = None
+		return state
+
+	### When the commit is done, the trees of this revision and its parents may not be needed anymore
+	def complete(self):
+		super().complete()
+		self.release_trees()
+		parents = self.parents
+		if self.fast_forward_rev is not None:
+			parents = [self.fast_forward_rev, *parents]
+		if self.staging_base_rev is not None:
+			parents = [self.staging_base_rev, *parents]
+		for parent_rev in parents:
+			parent_rev.tree_users -= 1
+			parent_rev.release_trees()
+			continue
+		return
+
+	### release_trees() drops the trees and the staged index snapshot of this revision,
+	# after it cannot be merged from anymore, its commit is done,
+	# and the commits using it as a parent are done.
+	# Only the Git SHA1 of the trees are kept
+	def release_trees(self):
+		if self.released or self.history_refs or self.tree_users or not self.is_completed \
+				or self is self.branch.HEAD or self is self.branch.stage:
+			return
+		self.released = True
+		self.tree = None
+		self.staged_tree = None
+		self.committed_tree = None
+		self.staged_index = None
+		return
+
 	def get_cherrypick_str(self):
 		cherry_pick_msg = []
 		# Sort by ascending revision number
@@ -301,12 +361,12 @@ class project_branch_rev(async_workitem):
 		deleted_files = []
 		added_dirs = []
 		deleted_dirs = []
-		# staged_tree could be None. Invoke the comparison in reverse order,
-		# and swap the result
-		for t in self.tree.compare(base_tree):
+		# base_tree could be None. Invoke the comparison through the tree type.
+		# The trees are compared in the same order as by get_difflist(), to use the cached result
+		for t in type(self.tree).compare(base_tree, self.tree, diff_cache=self.branch.proj_tree.diff_cache):
 			path = t[0]
-			obj2 = t[1]
-			obj1 = t[2]
+			obj1 = t[1]
+			obj2 = t[2]
 
 			if self.branch.ignore_file(path):
 				continue
@@ -369,7 +429,7 @@ class project_branch_rev(async_workitem):
 			for t1 in deleted_files:
 				old_path, file1 = t1
 				# Not considering renames of empty files
-				if file1.data and file1.data_sha1 == file2.data_sha1:
+				if file1.data_len and file1.data_sha1 == file2.data_sha1:
 					renamed_files.append((old_path, new_path))
 					added_files.remove(t2)
 					deleted_files.remove(t1)
@@ -446,6 +506,7 @@ class project_branch_rev(async_workitem):
 		return [title, '\n'.join(log)]
 
 	def add_parent_revision(self, add_rev):
+		assert(not add_rev.released)
 		if add_rev.tree is None:
 			return
 
@@ -475,6 +536,7 @@ class project_branch_rev(async_workitem):
 		if HEAD.tree or HEAD.commit:
 			self.parents.append(HEAD)
 			self.add_dependency(HEAD)
+			HEAD.tree_users += 1
 
 		# Process revisions to merge dictionary, if present
 		if self.revisions_to_merge is not None:
@@ -489,6 +551,7 @@ class project_branch_rev(async_workitem):
 					self.any_changes_present = False
 				self.parents.append(parent_rev)
 				self.add_dependency(parent_rev)
+				parent_rev.tree_users += 1
 				parent_rev.mark_need_commit()
 				continue
 
@@ -583,6 +646,7 @@ class project_branch_rev(async_workitem):
 		if self.tree is None:
 			return False
 		if type(source) is not type(self.tree):
+			assert(not source.released)
 			source = source.tree
 		if source is None:
 			return False
@@ -654,7 +718,8 @@ class project_branch_rev(async_workitem):
 
 	### See if this revision is present in all_merged_revisions_dict
 	def get_revision_merged_at(self, all_merged_revisions_dict):
-		if self.tree is None:
+		# A released revision had a tree
+		if self.tree is None and not self.released:
 			return None
 		(merged_rev, merged_at_rev) = \
 			all_merged_revisions_dict.get((self.branch, self.index_seq), (None, None))
@@ -678,7 +743,11 @@ class project_branch_rev(async_workitem):
 		prev_rev = HEAD
 
 		if prev_rev.staged_tree is None and self.revisions_to_merge is not None:
-			for new_prev_rev in self.revisions_to_merge.values():
+			# Prefer candidates which already have an index file in the branch pool,
+			# to avoid writing the index file for the new staging base
+			candidates = sorted(self.revisions_to_merge.values(),
+					key=lambda rev: self.branch.find_index_file(rev) is None)
+			for new_prev_rev in candidates:
 				if new_prev_rev.staged_tree is None:
 					continue
 				# tentative parent
@@ -706,7 +775,7 @@ class project_branch_rev(async_workitem):
 			new_tree = branch.proj_tree.empty_tree
 
 		difflist = []
-		for t in old_tree.compare(new_tree, "", expand_dir_contents=True):
+		for t in old_tree.compare(new_tree, "", expand_dir_contents=True, diff_cache=branch.proj_tree.diff_cache):
 			path = t[0]
 
 			obj2 = t[2]
@@ -714,7 +783,7 @@ class project_branch_rev(async_workitem):
 			if branch.ignore_file(path):
 				if not obj2:
 					continue
-				ignored_path = getattr(obj2, 'ignored_path', None)
+				ignored_path = branch.proj_tree.ignored_paths.get(obj2.object_sha1)
 				if ignored_path and (path == ignored_path or path.endswith('/' + ignored_path)):
 					continue
 				# Print the message only once for the given blob, when it's used with the same relative path
@@ -728,7 +797,7 @@ class project_branch_rev(async_workitem):
 					if not parent_dir or not branch.ignore_file(parent_dir):
 						print('IGNORED: Directory %s' % (path,), file=self.log_file)
 					# else The whole parent directory is ignored; don't print the message for every subdirectory
-				obj2.ignored_path = path
+				branch.proj_tree.ignored_paths[obj2.object_sha1] = path
 				continue
 
 			difflist.append(t)
@@ -808,6 +877,8 @@ class project_branch_rev(async_workitem):
 
 	def build_stagelist(self, HEAD):
 		HEAD = self.get_staging_base(HEAD)
+		# The staging callbacks use the staging base snapshot
+		HEAD.tree_users += 1
 
 		staging_info = async_workitem(executor=self.executor, futures_executor=self.futures_executor)
 
@@ -843,8 +914,12 @@ class project_branch_rev(async_workitem):
 				break
 		else:
 			if HEAD is not self.prev_rev or branch.gitattributes_sha1 is None:
+				assert(not self.prev_rev.released)
 				branch.make_gitattributes_tree(self.tree, self.prev_rev.tree)
 
+		# Select the index file to stage this revision. This can also update the environment
+		need_write_index, index_file_prev_rev = branch.select_index_file(self, HEAD)
+
 		# Need to save the git environment now, after make_gitattributes_tree(),
 		# which can update the environment
 		self.git_env = branch.git_env
@@ -878,17 +953,21 @@ class project_branch_rev(async_workitem):
 			git_sha1 = branch.proj_tree.sha1_map.get(sha1, None)
 			if git_sha1 is not None:
 				obj.git_sha1 = git_sha1
+				obj.release_data()
 				continue
 
 			git_sha1 = branch.proj_tree.prev_sha1_map.get(sha1, None)
 			if git_sha1 is not None:
 				branch.proj_tree.sha1_map[sha1] = git_sha1
 				obj.git_sha1 = git_sha1
+				obj.release_data()
 				continue
 
 			obj.git_sha1 = async_workitem(executor=branch.executor)
 			staging_info.add_dependency(obj.git_sha1)
-			obj.git_sha1.set_async_func(branch.hash_object, obj.data,
+			# If the blob data has been released, it's loaded again here,
+			# because the history source might not be safe to read from other threads
+			obj.git_sha1.set_async_func(branch.hash_object, obj, obj.get_data(),
 								path, sha1, fmt, self.git_env, self.log_file)
 			obj.git_sha1.ready()
 			continue
@@ -896,23 +975,30 @@ class project_branch_rev(async_workitem):
 		self.staged_tree = self.tree
 		self.any_changes_present = len(stagelist) != 0
 
-		if HEAD is not self.prev_rev:
+		if need_write_index:
 			# Need to read the new staging base
-			read_tree_info = async_workitem(HEAD.staging_info,
-									futures_executor=branch.proj_tree.write_tree_executor)
+			read_tree_info = async_workitem(executor=self.executor)
+			if HEAD.staging_info:
+				read_tree_info.add_dependency(HEAD.staging_info)
 			staging_info.add_dependency(read_tree_info)
 			read_tree_info.set_async_func(self.read_tree_callback)
 			read_tree_info.ready()
 		elif HEAD.staging_info:
 			staging_info.add_dependency(HEAD.staging_info)
 
+		if index_file_prev_rev is not None and index_file_prev_rev.staging_info is not None:
+			# The index file is reused from another revision, its operations must be done first
+			if need_write_index:
+				read_tree_info.add_dependency(index_file_prev_rev.staging_info)
+			else:
+				staging_info.add_dependency(index_file_prev_rev.staging_info)
+
 		if stagelist:
 			staging_info.set_async_func(self.stage_changes_callback, stagelist)
 			staging_info.ready()
 
 			# Replace staging_info with write-tree callback async item
-			staging_info = async_workitem(staging_info,
-										futures_executor=branch.proj_tree.write_tree_executor)
+			staging_info = async_workitem(staging_info)
 			staging_info.set_async_func(self.write_tree_callback)
 		else:
 			staging_info.set_completion_func(self.no_stage_changes_callback)
@@ -923,20 +1009,44 @@ class project_branch_rev(async_workitem):
 
 		return
 
-	def read_tree_callback(self):
-		self.branch.git_repo.read_tree(self.staging_base_rev.staged_git_tree, '-i', '--reset', env=self.git_env)
+	# The index callbacks are coroutines, run by the common asyncio loop.
+	# The Git processes they start run concurrently, within GIT.PROCESS_LIMITS.
+	# Their own CPU and file work (serializing and hashing the staged trees, writing index files
+	# and tree objects) is run in the loop's executor threads, to not block the loop
+	async def read_tree_callback(self):
+		if self.branch.git_repo.in_memory_index:
+			# The staging base snapshot is used directly by stage_changes_callback
+			return
+		# Instead of "git read-tree", the index file is written directly from the staging base snapshot.
+		# Only the directories changed since the snapshot SHA1s were calculated are hashed again
+		await asyncio.to_thread(write_index_file,
+					self.staging_base_rev.staged_index, self.git_env['GIT_INDEX_FILE'])
 		return
 
 	def no_stage_changes_callback(self):
 		self.staged_git_tree = self.staging_base_rev.staged_git_tree
+		self.staged_index = self.staging_base_rev.staged_index
 		return
 
-	def stage_changes_callback(self, stagelist):
-		self.branch.stage_changes(stagelist, self.git_env)
+	async def stage_changes_callback(self, stagelist):
+		# The snapshot of the staged tree is also kept when the staging is done in the index file,
+		# to write the index file if this revision becomes a staging base for another one
+		self.staged_index = await asyncio.to_thread(self.staging_base_rev.staged_index.apply, stagelist)
+		if self.branch.git_repo.in_memory_index:
+			return
+		await self.branch.stage_changes(stagelist, self.git_env)
 		return
 
-	def write_tree_callback(self):
-		self.staged_git_tree = self.branch.git_repo.write_tree(self.git_env)
+	async def write_tree_callback(self):
+		git_repo = self.branch.git_repo
+		if git_repo.fast_import is not None:
+			# The tree objects are made by fast-import
+			self.staged_git_tree = await asyncio.to_thread(self.staged_index.get_sha1)
+			return
+		if git_repo.in_memory_index:
+			self.staged_git_tree = await asyncio.to_thread(git_repo.write_index_tree, self.staged_index)
+			return
+		self.staged_git_tree = await git_repo.write_tree_async(self.git_env)
 		return
 
 ## project_branch - keeps a context for a single change branch (or tag) of a project
@@ -976,13 +1086,21 @@ class project_branch(dependency_node):
 		self.format_specifications = branch_map.format_specifications
 
 		# Absolute path to the working directory.
-		# index files (".git.index<index_seq>") and .gitattributes files will be placed there
+		# index files (".git.index<n>") and .gitattributes files will be placed there
 		self.git_index_directory = workdir
 		self.index_seq = 0
 		self.workdir_seq = 0
 		if workdir:
 			workdir.mkdir(parents=True, exist_ok = True)
 
+		# Pool of index files. It's an ordered dictionary of revisions (project_branch_rev),
+		# keyed by the index file name. The file keeps (or will keep, when queued staging operations are done)
+		# the staged tree of this revision. The most recently used file is at the end.
+		self.index_files = OrderedDict()
+		self.index_file_seq = 0
+		self.index_pool_size = max(1, getattr(proj_tree.options, 'index_pool_size', DEFAULT_INDEX_POOL_SIZE))
+		self.index_file = self.make_index_file_name()
+
 		self.git_env = self.make_git_env()
 
 		# Null tree SHA1
@@ -1002,6 +1120,8 @@ class project_branch(dependency_node):
 			self.revisions_ref = branch_map.refname.replace('refs/', 'refs/revisions/', 1)
 
 		self.init_head_rev()
+		# The initial index file doesn't exist yet, which makes an empty index
+		self.index_files[self.index_file] = self.HEAD
 
 		refname = self.refname
 		if refname and refname in proj_tree.append_to_refs:
@@ -1021,6 +1141,7 @@ class project_branch(dependency_node):
 	def init_head_rev(self):
 		HEAD = project_branch_rev(self)
 		HEAD.staged_git_tree = self.initial_git_tree
+		HEAD.staged_index = EMPTY_INDEX_TREE
 
 		self.HEAD = HEAD
 		self.stage = project_branch_rev(self, HEAD)
@@ -1048,10 +1169,13 @@ class project_branch(dependency_node):
 				continue
 			else:
 				Path.mkdir(self.git_working_directory.joinpath(directory), parents=True, exist_ok = True)
-			self.git_working_directory.joinpath(path).write_bytes(obj.data)
+			self.git_working_directory.joinpath(path).write_bytes(obj.get_data())
 			h.update(b"%s\t%b" % (path.encode(), obj.data_sha1))
 			continue
 
+		# The work directory may be reused, if the previous tree was empty.
+		# Its attributes need to be read again
+		self.git_repo.drop_attributes_stack(self.git_env)
 		self.gitattributes_sha1 = h.digest()
 		return
 
@@ -1107,9 +1231,60 @@ class project_branch(dependency_node):
 
 			return self.git_repo.make_env(
 					work_dir=str(self.git_working_directory),
-					index_file=str(self.git_index_directory.joinpath(".git.index" + str(self.index_seq))))
+					index_file=self.index_file)
 		return {}
 
+	def make_index_file_name(self):
+		if not self.git_index_directory:
+			return None
+		index_file = str(self.git_index_directory.joinpath(".git.index" + str(self.index_file_seq)))
+		self.index_file_seq += 1
+		return index_file
+
+	### find_index_file() returns a name of the file in the index pool,
+	# which keeps the staged tree of the given revision, or None
+	def find_index_file(self, rev_info):
+		if self.git_repo is None or self.git_repo.in_memory_index:
+			return None
+		for index_file, rev in reversed(self.index_files.items()):
+			if rev is rev_info:
+				return index_file
+		staged_git_tree = rev_info.staged_git_tree
+		if staged_git_tree is None:
+			return None
+		for index_file, rev in reversed(self.index_files.items()):
+			if rev.staged_git_tree == staged_git_tree:
+				return index_file
+		return None
+
+	### select_index_file() selects the index file to stage rev_info on top of base_rev.
+	# If the file keeping base_rev tree is in the pool, it's reused.
+	# Otherwise, a new file is added to the pool, or the least recently used file is taken,
+	# and it needs to be written from base_rev staged tree.
+	# Returns a tuple of:
+	# True if the index file needs to be written,
+	# the revision which used the file before, or None
+	def select_index_file(self, rev_info, base_rev):
+		if self.git_repo is None or self.git_repo.in_memory_index or not self.git_index_directory:
+			return base_rev is not rev_info.prev_rev, None
+
+		index_file = self.find_index_file(base_rev)
+		need_write_index = index_file is None
+		if not need_write_index:
+			pass
+		elif len(self.index_files) < self.index_pool_size:
+			index_file = self.make_index_file_name()
+		else:
+			index_file = next(iter(self.index_files))
+
+		prev_rev = self.index_files.pop(index_file, None)
+		self.index_files[index_file] = rev_info
+
+		if index_file != self.index_file:
+			self.index_file = index_file
+			self.git_env = self.make_git_env()
+		return need_write_index, prev_rev
+
 	def set_head_revision(self, revision):
 		rev_info = self.stage.set_revision(revision)
 		if rev_info is None:
@@ -1196,7 +1371,7 @@ class project_branch(dependency_node):
 					print("FAST FORWARD: Merge of %s;r%s to %s;r%s"
 						% (parent_rev.branch.name, parent_rev.rev,
 							rev_info.branch.name, rev_info.rev), file=rev_info.log_file)
-					rev_info.parents.pop(0)
+					rev_info.fast_forward_rev = rev_info.parents.pop(0)
 
 		need_commit = rev_info.need_commit
 		skip_commit = rev_info.skip_commit
@@ -1236,7 +1411,7 @@ class project_branch(dependency_node):
 			commit = git_repo.commit_tree(rev_info.staged_git_tree, parent_commits, rev_props.log,
 					author_name=author_info.author, author_email=author_info.email, author_date=rev_props.date,
 					committer_name=author_info.author, committer_email=author_info.email, committer_date=rev_props.date,
-					env=self.git_env)
+					env=self.git_env, tree_index=rev_info.staged_index)
 
 			commit_str = "\nCOMMIT:%s REF:%s BRANCH:%s;%s\n" % (commit, self.refname, self.name, rev_info.rev)
 			if not self.proj_tree.log_commits:
@@ -1250,7 +1425,13 @@ class project_branch(dependency_node):
 
 			# Make a ref for this revision in refs/revisions namespace
 			if self.revisions_ref:
-				self.update_ref('%s/r%s' % (self.revisions_ref, rev_info.rev), commit, log_file=rev_info.log_file.revision_ref)
+				# These refs are written directly to packed-refs, when possible
+				self.update_ref('%s/r%s' % (self.revisions_ref, rev_info.rev), commit,
+						log_file=rev_info.log_file.revision_ref, packed=True)
+
+			if self.proj_tree.revision_notes is not None:
+				self.proj_tree.revision_notes[commit] = b'HG-revision: %d\nHG-node: %s\n' % (
+					rev_info.rev, rev_info.rev_id.encode())
 
 			rev_info.rev_commit = commit	# commit made on this revision, not inherited
 			rev_info.committed_git_tree = rev_info.staged_git_tree
@@ -1290,20 +1471,17 @@ class project_branch(dependency_node):
 		rev_info.props_list = None
 		return
 
-	def stage_changes(self, stagelist, git_env):
-		git_process = self.git_repo.update_index(git_env)
-		pipe = git_process.stdin
+	async def stage_changes(self, stagelist, git_env):
+		index_info = []
 		for item in stagelist:
 			if item.obj is None:
 				# a path is deleted
-				pipe.write(b"000000 0000000000000000000000000000000000000000 0\t%s\n" % bytes(item.path, encoding='utf-8'))
+				index_info.append(b"000000 0000000000000000000000000000000000000000 0\t%s\n" % bytes(item.path, encoding='utf-8'))
 				continue
 			# a path is created or replaced
-			pipe.write(b"%06o %s 0\t%s\n" % (item.mode, bytes(item.obj.get_git_sha1(), encoding='utf-8'), bytes(item.path, encoding='utf-8')))
-
-		pipe.close()
-		git_process.wait()
+			index_info.append(b"%06o %s 0\t%s\n" % (item.mode, bytes(item.obj.get_git_sha1(), encoding='utf-8'), bytes(item.path, encoding='utf-8')))
 
+		await self.git_repo.update_index_async(b''.join(index_info), git_env)
 		return
 
 	def get_file_mode(self, path, obj):
@@ -1329,7 +1507,7 @@ class project_branch(dependency_node):
 			ignore = self.cfg.ignore_files.fullmatch(path)
 		return ignore
 
-	def hash_object(self, data, path, sha1, fmt, git_env, log_file):
+	def hash_object(self, obj, data, path, sha1, fmt, git_env, log_file):
 		if fmt is not None:
 			def error_handler(s):
 				print("WARNING: file %s:\n\t%s" % (path, s), file=log_file)
@@ -1339,10 +1517,16 @@ class project_branch(dependency_node):
 			TOTAL_FILES_REFORMATTED += 1
 			TOTAL_BYTES_IN_FILES_REFORMATTED += len(data)
 			data = format_files.format_data(data, fmt, error_handler)
+			data_sha1 = None
+		else:
+			# data_sha1 is Git SHA1 of unconverted data
+			data_sha1 = obj.data_sha1.hex()
 		# git_repo.hash_object will use the current environment from rev_info,
 		# to use the proper .gitattributes worktree
-		git_sha1 = self.git_repo.hash_object(data, path, env=git_env)
+		git_sha1 = self.git_repo.hash_object(data, path, env=git_env, data_sha1=data_sha1)
 		self.proj_tree.sha1_map[sha1] = git_sha1
+		# The blob is in the repository now, its data can be loaded again if ever needed
+		obj.release_data()
 		return git_sha1
 
 	def preprocess_blob_object(self, obj, path):
@@ -1382,19 +1566,20 @@ class project_branch(dependency_node):
 		else:
 			fmt = None
 
+		# The attributes dictionary is shared by copies of the object, and gets replaced
 		if fmt is not None:
 			if obj.git_attributes.get('formatting') != fmt.get_format_tag():
 				obj = obj.make_unshared()
-				obj.git_attributes['formatting'] = fmt.get_format_tag()
+				obj.git_attributes = { **obj.git_attributes, 'formatting' : fmt.get_format_tag() }
 		elif 'formatting' in obj.git_attributes:
 			obj = obj.make_unshared()
-			obj.git_attributes.pop('formatting')
+			obj.git_attributes = copy_map({ key : value for key, value in obj.git_attributes.items() if key != 'formatting' })
 
 		# Find git attributes - TODO fill cfg.gitattributes
 		for attr in self.cfg.gitattributes:
 			if attr.pattern.fullmatch(path) and obj.git_attributes.get(attr.key) != attr.value:
 				obj = obj.make_unshared()
-				obj.git_attributes[attr.key] = attr.value
+				obj.git_attributes = { **obj.git_attributes, attr.key : attr.value }
 
 		obj = proj_tree.finalize_object(obj)
 		obj.fmt = fmt	# AFTER finalize_object()
@@ -1465,9 +1650,9 @@ class project_branch(dependency_node):
 
 		return
 
-	def update_ref(self, refname, sha1, log_file=None):
+	def update_ref(self, refname, sha1, log_file=None, packed=False):
 		refname = self.cfg.map_ref(refname)
-		return self.proj_tree.update_ref(refname, sha1, self.name, log_file)
+		return self.proj_tree.update_ref(refname, sha1, self.name, log_file, packed)
 
 	def create_tag(self, tagname, sha1, props, log_file=None):
 		tagname = self.cfg.map_ref(tagname)
@@ -1488,13 +1673,15 @@ class project_branch(dependency_node):
 
 def make_git_object_class(base_type):
 	class git_object(base_type):
+		__slots__ = ('git_attributes',)
+
 		def __init__(self, src = None, properties=None):
 			super().__init__(src, properties)
 			if src:
-				self.git_attributes = src.git_attributes.copy()
+				self.git_attributes = src.git_attributes
 			else:
 				# These attributes also include prettyfication and CRLF normalization attributes:
-				self.git_attributes = {}
+				self.git_attributes = EMPTY_MAP
 			return
 
 		# return hashlib SHA1 object filled with hash of prefix, data SHA1, and SHA1 of all attributes
@@ -1536,16 +1723,21 @@ def make_git_object_class(base_type):
 	return git_object
 
 class git_tree(make_git_object_class(object_tree)):
+	__slots__ = ()
 
 	class item:
+		__slots__ = ('name', 'object', 'mode')
+
 		def __init__(self, name, obj, mode=None):
-			self.name = name
+			self.name = sys.intern(name)
 			self.object = obj
 			if obj.is_file() and mode:
 				self.mode = mode
 			return
 
 class git_blob(make_git_object_class(object_blob)):
+	__slots__ = ('git_sha1', 'fmt')
+
 	def __init__(self, src = None, properties=None):
 		super().__init__(src, properties)
 		# this is git sha1, produced by git-hash-object, as 40 chars hex string.
@@ -1565,7 +1757,7 @@ class git_blob(make_git_object_class(object_blob)):
 
 class log_serializer(dependency_node):
 
-	def __init__(self, *dep_nodes, log_output_file=None, log_refs_file=None, executor=None):
+	def __init__(self, *dep_nodes, log_output_file=None, log_refs_file=None, diff_cache=None, executor=None):
 		super().__init__(*dep_nodes, executor=executor)
 
 		if dep_nodes and type(dep_nodes[0]) is log_serializer:
@@ -1584,6 +1776,7 @@ class log_serializer(dependency_node):
 		self.need_dump = False
 		self.log_output_file = log_output_file
 		self.log_refs_file = log_refs_file
+		self.diff_cache = diff_cache
 		self.newlines = log_output_file.newlines
 		self.log_file = io.StringIO()
 		self.revision_ref = io.StringIO()
@@ -1643,11 +1836,16 @@ class log_serializer(dependency_node):
 			self.hg_revision = None
 
 		if self.prev_tree is not self.curr_tree:
-			diffs = [*type(self.prev_tree).compare(self.prev_tree, self.curr_tree, expand_dir_contents=True)]
+			diffs = [*type(self.prev_tree).compare(self.prev_tree, self.curr_tree, expand_dir_contents=True,
+												diff_cache=self.diff_cache)]
 			if len(diffs):
 				print("Comparing with previous revision:", file=self.log_output_file)
 				print_diff(diffs, self.log_output_file)
 				print("", file=self.log_output_file)
+		# The next serializer has been made from this one before it became ready.
+		# Don't keep the trees of released revisions
+		self.prev_tree = None
+		self.curr_tree = None
 
 		if self.log_file:
 			self.log_output_file.write(self.log_file.getvalue())
@@ -1668,6 +1866,87 @@ class log_serializer(dependency_node):
 		self.do_dump()
 		return super().complete()
 
+### state_pickler saves the conversion state.
+# The objects re-created by the next run (the project tree itself, its branches,
+# configuration, executors and the Git repository) are saved as references to them.
+# The work items are done by the time the state is saved, and are not kept
+class state_pickler(pickle.Pickler):
+	def __init__(self, file, persistent_objects):
+		super().__init__(file, protocol=pickle.HIGHEST_PROTOCOL)
+		self.persistent_ids = {id(obj) : pid for pid, obj in persistent_objects.items()}
+		return
+
+	def persistent_id(self, obj):
+		pid = self.persistent_ids.get(id(obj))
+		if pid is not None:
+			return pid
+		obj_type = type(obj)
+		if obj_type is async_workitem or obj_type is log_serializer:
+			return ('none',)
+		if obj_type is stored_content:
+			# The contents are only saved if they can't be read again from the history source.
+			# The same ID is kept for all references, to save the contents once
+			pid = ('content', obj.data_sha1, obj() if obj.source is None else None, obj.source)
+			self.persistent_ids[id(obj)] = pid
+			return pid
+		if obj_type is git_blob:
+			# Git SHA1 can still be kept by its hashing work item
+			if obj.git_sha1 is not None:
+				obj.git_sha1 = obj.get_git_sha1()
+			# The contents are loaded again from the data source, if needed
+			obj.release_data()
+		return None
+
+class state_unpickler(pickle.Unpickler):
+	def __init__(self, file, persistent_objects, content_store):
+		super().__init__(file)
+		self.persistent_objects = persistent_objects
+		self.content_store = content_store
+		return
+
+	def persistent_load(self, pid):
+		if pid == ('none',):
+			return None
+		if pid[0] == 'content':
+			return self.content_store.add(*pid[1:])
+		obj = self.persistent_objects.get(pid)
+		if obj is None:
+			raise Exception_history_parse("The conversion state doesn't match the configuration")
+		return obj
+
+### get_state_summary() returns the values of the conversion state which the resumed conversion depends on,
+# in a form which can be compared with the state loaded back: the revisions with their tree hashes,
+# and the branch revisions with their commits and trees
+def get_state_summary(state):
+	def tree_hash(tree):
+		return tree.get_hash() if tree is not None else None
+
+	def rev_info_summary(rev_info):
+		if rev_info is None:
+			return None
+		return (rev_info.branch.name, rev_info.index_seq, rev_info.rev, rev_info.commit, rev_info.rev_commit,
+			rev_info.staged_git_tree, rev_info.committed_git_tree, tree_hash(rev_info.tree),
+			rev_info.released, rev_info.tree_users, rev_info.history_refs,
+			rev_info.prev_rev.rev if rev_info.prev_rev is not None else None,
+			[(parent.branch.name, parent.index_seq, parent.rev) for parent in rev_info.parents],
+			sorted((key[0].name, key[1], merged.rev, merged_at.rev)
+				for key, (merged, merged_at) in rev_info.merged_revisions.items()))
+
+	return {
+		'revisions' : [(revision.rev, revision.rev_id, tree_hash(revision.tree), revision.need_commit)
+				if revision is not None else None for revision in state['revisions']],
+		'rev_infos' : [rev_info_summary(rev_info) for rev_info in state['rev_infos']],
+		'branches' : [([rev_info_summary(rev_info) for rev_info in revisions], first_revision,
+					index_seq, rev_info_summary(HEAD), rev_info_summary(stage))
+				for (revisions, first_revision, index_seq, HEAD, stage) in state['branches']],
+		'deleted_revs' : [rev_info_summary(rev_info) for rev_info in state['deleted_revs']],
+		'objects' : sorted(state['obj_dictionary']),
+		'empty_tree' : tree_hash(state['empty_tree']),
+		'filenode_dict' : state['filenode_dict'],
+		'sha1_map' : state['sha1_map'],
+		'all_refs' : sorted(ref for ref, obj in state['all_refs'].items()),
+		}
+
 class project_history_tree(history_reader):
 	BLOB_TYPE = git_blob
 	TREE_TYPE = git_tree
@@ -1703,6 +1982,16 @@ class project_history_tree(history_reader):
 		self.unmapped_authors = []
 		self.append_to_refs = {}
 		self.prune_refs = {}
+		# Paths the ignored files and directories were last reported for, keyed by object SHA1
+		self.ignored_paths = {}
+		# File to save the conversion state to, and resume from it, see load_state()
+		self.state_file = getattr(options, 'state_file', None)
+		self.verify_state = getattr(options, 'verify_state', False)
+		# Refs written by finalize_branches(), saved with the conversion state
+		self.finalized_refs = None
+		# HG revision notes, keyed by commit SHA1
+		self.revision_notes_ref = getattr(options, 'revision_notes', None)
+		self.revision_notes = {} if self.revision_notes_ref else None
 		# This is list of project configurations in order of their declaration
 		self.project_cfgs_list = project_config.project_config.make_config_list(options.config,
 											getattr(options, 'project_filter', []),
@@ -1710,7 +1999,7 @@ class project_history_tree(history_reader):
 
 		target_repo = getattr(options, 'target_repo', None)
 		if target_repo:
-			self.git_repo = git_repo.GIT(target_repo)
+			self.git_repo = git_repo.GIT(target_repo, backend=getattr(options, 'backend', 'subprocess'))
 			# Get absolute path of git-dir
 			git_dir = self.git_repo.get_git_dir(True)
 			self.git_working_directory = Path(git_dir, "hg_temp")
@@ -1729,6 +2018,8 @@ class project_history_tree(history_reader):
 
 		# Directory of actions to perform at given revision, keyed by integer revision number.
 		self.revision_actions = {}
+		# Cache for is_revision_needed()
+		self.branch_mapped_dict = {}
 		for cfg in self.project_cfgs_list:
 			# Make blobs for files to be injected
 			for file in cfg.inject_files:
@@ -1754,10 +2045,16 @@ class project_history_tree(history_reader):
 			actions = self.revision_actions.setdefault(int(extract_file_rev[1]), [])
 			actions.append(project_config.history_revision_action(b'extract', extract_file[1], copyfrom_path=extract_file_path))
 
+		# The source revisions of <CopyPath> and <MergeBranch> actions keep their trees
+		for actions in self.revision_actions.values():
+			for action in actions:
+				if action.copyfrom_rev is not None:
+					self.pinned_revisions.add(action.copyfrom_rev)
+				continue
+			continue
+
 		self.executor = async_executor()
 		self.futures_executor=concurrent.futures.ThreadPoolExecutor(max_workers=min(4, os.cpu_count()+ 1))
-		# Serialize all write-tree invocations into a single worker thread
-		self.write_tree_executor=concurrent.futures.ThreadPoolExecutor(max_workers=1)
 
 		refs_list = getattr(options, 'prune_refs', None)
 		if self.git_repo and refs_list:
@@ -1771,6 +2068,9 @@ class project_history_tree(history_reader):
 		if options.sha1_map:
 			self.load_sha1_map(options.sha1_map)
 
+		if getattr(options, 'filenode_map', None):
+			self.load_filenode_map(options.filenode_map)
+
 		if options.authors_map:
 			self.load_authors_map(options.authors_map)
 
@@ -1781,7 +2081,7 @@ class project_history_tree(history_reader):
 
 	def shutdown(self):
 		self.futures_executor.shutdown(cancel_futures=True)
-		self.write_tree_executor.shutdown(cancel_futures=True)
+		async_loop.shutdown()
 
 		# Unwind all canceled items to properly flush the log
 		while self.executor.run(existing_only=False,block=False): pass
@@ -1799,6 +2099,7 @@ class project_history_tree(history_reader):
 		return log_serializer(*prev_serializer,
 							log_output_file=self.options.log_file,
 							log_refs_file=self.revision_ref_log_file,
+							diff_cache=self.diff_cache,
 							executor=executor)
 
 	def next_log_serializer(self):
@@ -1876,6 +2177,40 @@ class project_history_tree(history_reader):
 		self.unmapped_branches[name] = True
 		return None
 
+	### is_revision_needed() is used by the revision reader to skip revisions not needed for conversion.
+	# A revision is needed if its branch is mapped to a ref, or there are actions for it,
+	# or it's a source of <CopyPath> or <MergeBranch> action. The actions can refer to a revision
+	# by number or by RevId. Unlike get_branch_map(), this function doesn't log anything
+	def is_revision_needed(self, rev, rev_id, branch):
+		if rev in self.revision_actions or rev_id in self.revision_actions \
+				or rev in self.pinned_revisions or rev_id in self.pinned_revisions:
+			return True
+		mapped = self.branch_mapped_dict.get(branch)
+		if mapped is None:
+			mapped = False
+			for cfg in self.project_cfgs_list:
+				branch_map = cfg.map_branch(branch)
+				if branch_map is not None:
+					mapped = bool(branch_map.refname)
+					break
+			self.branch_mapped_dict[branch] = mapped
+		return mapped
+
+	### is_path_unused() returns True if the path is ignored in all projects.
+	# Such files are skipped by the revision reader.
+	# .gitignore and .gitattributes files are always read, because they're made from .hgignore and .hgeol
+	def is_path_unused(self, path):
+		if path.rpartition('/')[2] in ('.gitattributes', '.gitignore'):
+			return False
+		for cfg in self.project_cfgs_list:
+			if not cfg.ignore_files.fullmatch(path):
+				return False
+			# A branch mapping can override the project's ignore specification
+			for path_map in cfg.map_list:
+				if path_map.ignore_files.fullmatch(path) is False:
+					return False
+		return True
+
 	## Adds a new branch for name in this revision, possibly with source revision
 	# The function must not be called when a branch already exists
 	def add_branch(self, branch_map):
@@ -1941,7 +2276,7 @@ class project_history_tree(history_reader):
 		self.all_refs.set_used_by(new_ref, new_ref, name, match_full_path=True)
 		return new_ref
 
-	def update_ref(self, ref, sha1, name, log_file=None):
+	def update_ref(self, ref, sha1, name, log_file=None, packed=False):
 		if log_file is None:
 			log_file = self.log_file
 
@@ -1951,6 +2286,8 @@ class project_history_tree(history_reader):
 
 		print('WRITE REF: %s %s' % (sha1, ref), file=log_file)
 		self.append_to_refs.pop(ref, "")
+		if self.finalized_refs is not None:
+			self.finalized_refs[ref] = sha1
 
 		if ref.startswith('refs/tags/'):
 			self.total_tags_made += 1
@@ -1964,7 +2301,7 @@ class project_history_tree(history_reader):
 
 			del self.prune_refs[ref]
 
-		self.git_repo.queue_update_ref(ref, sha1)
+		self.git_repo.queue_update_ref(ref, sha1, packed)
 		self.total_refs_to_update += 1
 
 		return ref
@@ -1980,7 +2317,7 @@ class project_history_tree(history_reader):
 		print('CREATE TAG: %s %s' % (sha1, tagname), file=log_file)
 
 		self.git_repo.tag(tagname.removeprefix('refs/tags/'), sha1, props.log,
-			props.author_info.author, props.author_info.email, props.date, '-f')
+			props.author_info.author, props.author_info.email, props.date)
 		self.total_tags_made += 1
 
 		self.append_to_refs.pop(tagname, "")
@@ -2027,15 +2364,11 @@ class project_history_tree(history_reader):
 
 		return base_tree
 
-	def apply_file_node(self, node, base_tree):
-		base_tree = super().apply_file_node(node, base_tree)
-		if node.action != b'delete':
-			branch = self.head_branch
-			if branch:
-				file = base_tree.find_path(node.path)
-				base_tree = base_tree.set(node.path, file,
-								mode=branch.get_file_mode(node.path, file))
-		return base_tree
+	def set_file(self, base_tree, path, obj):
+		branch = self.head_branch
+		if branch:
+			return base_tree.set(path, obj, mode=branch.get_file_mode(path, obj))
+		return super().set_file(base_tree, path, obj)
 
 	def apply_branch_node(self, node, base_tree):
 		branch = self.head_branch
@@ -2135,15 +2468,9 @@ class project_history_tree(history_reader):
 		self.set_branch_changed(branch)
 		return base_tree
 
-	def apply_revision(self, revision):
-		# Apply the revision to the previous revision, checking if new branches are created
-		# into commit(s) in the git repository.
-
-		self.revision_has_nodes = False
-		self.revision_need_dump = self.log_dump_all
-
-		revision = super().apply_revision(revision)
-
+	### apply_revision_actions() applies the revision actions from the configuration,
+	# before the revision tree is finalized
+	def apply_revision_actions(self, revision):
 		rev_actions = self.revision_actions.get(revision.rev, []) + self.revision_actions.get(revision.rev_id, [])
 		for rev_action in rev_actions:
 			if rev_action.action == b'add':
@@ -2188,13 +2515,22 @@ class project_history_tree(history_reader):
 					raise Exception_history_parse('--extract-file refers to path "%s" in revision %s which is not a file'
 							% (rev_action.copyfrom_path, revision.rev_id))
 				with open(rev_action.path, 'wb') as fd:
-					fd.write(file.data)
+					fd.write(file.get_data())
 				continue
 
 			revision.tree = self.apply_node(rev_action, revision.tree)
 			continue
 
-		revision.tree = self.finalize_object(revision.tree)
+		return
+
+	def apply_revision(self, revision):
+		# Apply the revision to the previous revision, checking if new branches are created
+		# into commit(s) in the git repository.
+
+		self.revision_has_nodes = False
+		self.revision_need_dump = self.log_dump_all
+
+		revision = super().apply_revision(revision)
 
 		# self.revision_need_dump is set when dump_all is specified or a revision has non-ignored nodes
 		# Such revision will show up in the dump (only dumped if verbose=dump)
@@ -2216,12 +2552,31 @@ class project_history_tree(history_reader):
 
 			continue
 
+		# The branch revision can be merged from, while the history revision is not released
+		revision.rev_info = None
+		if revision.branch is not None:
+			revision.rev_info = revision.branch.get_revision(revision.rev)
+			if revision.rev_info is not None:
+				revision.rev_info.history_refs += 1
+
 		self.executor.run(existing_only=True)
 
 		self.branches_changed.clear()
 
 		return revision
 
+	### release_revision() also releases the trees of the branch revision,
+	# when no other history revision refers to it
+	def release_revision(self, revision):
+		super().release_revision(revision)
+		rev_info = revision.rev_info
+		if revision.tree is not None or rev_info is None:
+			return
+		revision.rev_info = None
+		rev_info.history_refs -= 1
+		rev_info.release_trees()
+		return
+
 	def print_progress_line(self, rev=None):
 
 		if rev is None:
@@ -2279,12 +2634,19 @@ class project_history_tree(history_reader):
 			self.options.log_dump_all = False
 			self.options.log_revs = False
 
+		if getattr(self.options, 'skip_unused_history', False) and hasattr(revision_reader, 'set_filters'):
+			revision_reader.set_filters(self.is_revision_needed, self.is_path_unused)
+
 		# delete it if it existed
 		shutil.rmtree(self.git_working_directory, ignore_errors=True)
 		# make temp directory
 		self.git_working_directory.mkdir(parents=True, exist_ok = True)
 
+		state = None
 		try:
+			if self.state_file:
+				self.load_state(self.state_file, revision_reader)
+
 			try:
 				super().load(revision_reader)
 			except:
@@ -2314,11 +2676,22 @@ class project_history_tree(history_reader):
 			# Flush the log of revision ref updates
 			self.log_file.write(self.revision_ref_log_file.getvalue())
 
+			if self.state_file:
+				# The state is taken before finalize_branches(), which is done again by the next run
+				state = self.save_state(revision_reader)
+				self.finalized_refs = {}
+
 			self.finalize_branches()
 
+			finalized_refs = self.finalized_refs
+			self.finalized_refs = None
+
 			# Flush leftover workitems (typically, only heads of deleted branches)
 			while self.executor.run(existing_only=False,block=False): pass
 
+			if self.revision_notes:
+				self.write_revision_notes()
+
 			for ref, sha1 in self.prune_refs.items():
 				self.total_refs_to_update += 1
 				print('PRUNE REF: %s %s' % (sha1, ref), file=self.log_file)
@@ -2330,6 +2703,9 @@ class project_history_tree(history_reader):
 
 			git_repo.commit_refs_update()
 
+			if state is not None:
+				self.write_state_file(self.state_file, state, finalized_refs)
+
 			self.print_progress_message("done")
 			self.print_final_progress_line()
 
@@ -2338,6 +2714,9 @@ class project_history_tree(history_reader):
 			if self.options.sha1_map:
 				self.save_sha1_map(self.options.sha1_map)
 
+			if getattr(self.options, 'filenode_map', None):
+				self.save_filenode_map(self.options.filenode_map)
+
 		finally:
 			async_workitem.shutdown()
 			self.shutdown()
@@ -2412,6 +2791,223 @@ class project_history_tree(history_reader):
 
 		return
 
+	### write_revision_notes() writes the HG revision mapping for all commits made,
+	# as a single new commit of the notes ref
+	def write_revision_notes(self):
+		self.print_progress_message(
+			"\r                                                                  \r" +
+			"Writing %d notes to %s...." % (len(self.revision_notes), self.revision_notes_ref), end='')
+
+		commit = self.git_repo.write_notes(self.revision_notes_ref, self.revision_notes,
+								'Notes added by hg-to-git')
+		self.update_ref(self.revision_notes_ref, commit, None)
+		self.revision_notes = {}
+		return
+
+	### get_state_objects() returns the objects not saved with the conversion state,
+	# because they're re-created by each run. They're keyed by their persistent IDs
+	def get_state_objects(self):
+		objects = {
+			('proj_tree',) : self,
+			('executor',) : self.executor,
+			('futures_executor',) : self.futures_executor,
+			('git_repo',) : self.git_repo,
+			('empty_index',) : EMPTY_INDEX_TREE,
+			}
+		for i, branch in enumerate(self.branches_list):
+			objects[('branch', i)] = branch
+			for j, fmt in enumerate(branch.format_specifications):
+				objects[('branch_fmt', i, j)] = fmt
+		for i, cfg in enumerate(self.project_cfgs_list):
+			objects[('cfg', i)] = cfg
+			for j, fmt in enumerate(cfg.format_specifications):
+				objects[('cfg_fmt', i, j)] = fmt
+			for j, skip_commit in enumerate(cfg.skip_commit_list):
+				objects[('skip_commit', i, j)] = skip_commit
+		return objects
+
+	### get_all_rev_infos() returns all project_branch_rev objects of all branches,
+	# in order of their revisions. Saved in this order, the revisions each of them refers to
+	# are mostly saved before it, which avoids deep recursion
+	def get_all_rev_infos(self):
+		rev_infos = {}
+		for rev_info in (*(branch.stage for branch in self.branches_list),
+						*(rev_info for branch in self.branches_list for rev_info in branch.revisions),
+						*self.deleted_revs):
+			while rev_info is not None and id(rev_info) not in rev_infos:
+				rev_infos[id(rev_info)] = rev_info
+				rev_info = rev_info.prev_rev
+			continue
+
+		def rev_info_order(rev_info):
+			if rev_info.rev is not None:
+				return rev_info.rev
+			if rev_info.prev_rev is None:
+				# Initial HEAD of a branch
+				return -1
+			# Stage of a branch
+			return len(self.revisions)
+
+		return sorted(rev_infos.values(), key=rev_info_order)
+
+	### save_state() returns the serialized conversion state, to resume the conversion
+	# in the next run, after the revisions converted by this run.
+	# The state consists of the header with the revision reader state and the names of the branches to re-create,
+	# and the revisions and branches state
+	def save_state(self, revision_reader):
+		self.print_progress_message(
+			"\r                                                                  \r" +
+			"Saving the conversion state....", end='')
+
+		for revision in self.revisions:
+			if revision is not None:
+				revision.hg_revision = None
+
+		header = pickle.dumps({
+			'version' : STATE_FILE_VERSION,
+			'reader' : revision_reader.get_resume_state(len(self.revisions)),
+			'branches' : [branch.name for branch in self.branches_list],
+			}, protocol=pickle.HIGHEST_PROTOCOL)
+
+		state = {
+			'revisions' : self.revisions,
+			'rev_infos' : self.get_all_rev_infos(),
+			'branches' : [(branch.revisions, branch.first_revision, branch.index_seq, branch.HEAD, branch.stage)
+							for branch in self.branches_list],
+			'deleted_revs' : self.deleted_revs,
+			'obj_dictionary' : dict(self.obj_dictionary),
+			'empty_tree' : self.empty_tree,
+			'filenode_dict' : self.filenode_dict,
+			'sha1_map' : self.sha1_map,
+			'unmapped_branches' : self.unmapped_branches,
+			'all_refs' : self.all_refs,
+			}
+		fd = io.BytesIO()
+		state_pickler(fd, self.get_state_objects()).dump(state)
+		body = fd.getvalue()
+
+		if self.verify_state:
+			self.verify_saved_state(state, body)
+
+		self.print_progress_message("done")
+		return header, body
+
+	### verify_saved_state() loads the state just serialized by save_state(),
+	# and checks that the revisions and branches loaded are the same as saved.
+	# The contents are loaded to a separate store, to leave the store of this run intact
+	def verify_saved_state(self, state, body):
+		loaded_state = state_unpickler(io.BytesIO(body), self.get_state_objects(), content_store()).load()
+
+		saved_summary = get_state_summary(state)
+		loaded_summary = get_state_summary(loaded_state)
+		for key, saved_value in saved_summary.items():
+			if loaded_summary[key] != saved_value:
+				raise Exception_history_parse('The conversion state doesn\'t load back the same: "%s" differs' % key)
+			continue
+		return
+
+	### write_state_file() writes the state made by save_state(), with the refs written by finalize_branches() after the header.
+	# The file is only written after the refs are updated, and replaced atomically
+	def write_state_file(self, filename, state, finalized_refs):
+		header, body = state
+		tmp_file = filename + '.tmp'
+		with open(tmp_file, 'wb') as fd:
+			fd.write(header)
+			pickle.dump(finalized_refs, fd, protocol=pickle.HIGHEST_PROTOCOL)
+			fd.write(body)
+		os.replace(tmp_file, filename)
+		return
+
+	### load_state() loads the conversion state saved by the previous run, and sets up the revision reader
+	# to resume reading after the revisions already converted. If the file doesn't exist, the conversion starts from the beginning.
+	# If the repository history has changed so that resuming would not make the same result as converting it from the beginning,
+	# the state is not used.
+	# The refs written by finalize_branches() of the previous run are pruned, unless they're written again
+	def load_state(self, filename, revision_reader):
+		try:
+			fd = open(filename, 'rb')
+		except FileNotFoundError:
+			return
+
+		with fd:
+			try:
+				header = pickle.load(fd)
+				finalized_refs = pickle.load(fd)
+			except (pickle.UnpicklingError, EOFError):
+				header = None
+			if type(header) is not dict or header.get('version') != STATE_FILE_VERSION:
+				raise Exception_history_parse('File "%s" is not a conversion state file' % filename)
+
+			if not hasattr(revision_reader, 'resume'):
+				raise Exception_history_parse('The conversion cannot be resumed with this revision source')
+
+			reason = revision_reader.resume(header['reader'])
+			if reason is not None:
+				print('Conversion state "%s" not used: %s. Converting from the beginning' % (filename, reason),
+					file=self.log_file)
+				self.print_progress_message('WARNING: Conversion state not used: %s' % reason)
+				self.prune_refs.update(finalized_refs)
+				return
+
+			# The branches are re-created from their current configuration, in the same order
+			for name in header['branches']:
+				branch_map = self.get_branch_map(name)
+				if branch_map is None:
+					raise Exception_history_parse('Branch "%s" of the conversion state is not mapped by the configuration' % name)
+				self.add_branch(branch_map)
+
+			state = state_unpickler(fd, self.get_state_objects(), self.content_store).load()
+
+		self.revisions = state['revisions']
+		for revision in self.revisions:
+			if revision is not None:
+				self.revision_dict[revision.rev_id] = revision
+
+		for rev_info in state['rev_infos']:
+			if rev_info.prev_rev is not None:
+				rev_info.prev_rev.next_rev = rev_info
+
+		for branch, (revisions, first_revision, index_seq, HEAD, stage) in zip(self.branches_list, state['branches']):
+			branch.revisions = revisions
+			branch.first_revision = first_revision
+			branch.index_seq = index_seq
+			branch.HEAD = HEAD
+			branch.stage = stage
+			# The index files are gone. The first staging writes a new file from its staging base
+			branch.index_files.clear()
+			continue
+
+		self.deleted_revs = state['deleted_revs']
+		# Blobs made by this run (injected files) are only added if not present
+		state['obj_dictionary'].update((key, obj) for key, obj in self.obj_dictionary.items()
+									if key not in state['obj_dictionary'])
+		self.obj_dictionary = weakref.WeakValueDictionary(state['obj_dictionary'])
+		self.empty_tree = state['empty_tree']
+		state['filenode_dict'].update(self.filenode_dict)
+		self.filenode_dict = state['filenode_dict']
+		self.sha1_map = state['sha1_map']
+		self.unmapped_branches.update(state['unmapped_branches'])
+		self.all_refs = state['all_refs']
+
+		# The data sources of blobs need the repository handle of this run
+		repository = getattr(revision_reader, 'repository', None)
+		for obj in state['obj_dictionary'].values():
+			data_source = getattr(obj, 'data_source', None)
+			if type(data_source) is stored_content:
+				data_source = data_source.source
+			if data_source is not None and hasattr(data_source, 'repository'):
+				data_source.repository = repository
+			continue
+
+		# The refs written by the previous run are not pruned,
+		# except for those written by finalize_branches(), and not written again now
+		for ref, obj in self.all_refs.items():
+			self.prune_refs.pop(ref, None)
+		self.prune_refs.update(finalized_refs)
+
+		print('Resuming the conversion from revision %d' % len(self.revisions), file=self.log_file)
+		return
+
 	def load_sha1_map(self, filename):
 		try:
 			with open(filename, 'rt', encoding='utf-8') as fd:
@@ -2430,6 +3026,26 @@ class project_history_tree(history_reader):
 				print(obj_sha1, git_sha1, file=fd)
 		return
 
+	### The filenode map file keeps length and Git blob SHA1 of unconverted contents of file revisions,
+	# keyed by Mercurial filenode, as lines of: <filenode> <length> <SHA1>.
+	# With it, the blobs of known file revisions are made without reading their contents
+	def load_filenode_map(self, filename):
+		try:
+			with open(filename, 'rt', encoding='utf-8') as fd:
+				for line in fd:
+					filenode, data_len, data_sha1 = line.split()
+					self.filenode_dict[bytes.fromhex(filenode)] = (int(data_len), bytes.fromhex(data_sha1))
+		except FileNotFoundError as fnf:
+			pass
+		return
+
+	def save_filenode_map(self, filename):
+
+		with open(filename, 'wt', encoding='utf-8') as fd:
+			for filenode, (data_len, data_sha1) in sorted(self.filenode_dict.items()):
+				print(filenode.hex(), data_len, data_sha1.hex(), file=fd)
+		return
+
 	def print_unmapped_branches(self, fd):
 		unmapped = sorted(branch for branch, mapped in self.unmapped_branches.items() if mapped)
 
@@ -2561,5 +3177,7 @@ def print_stats(fd):
 	if TOTAL_FILES_REFORMATTED:
 		print("Reformatting: done %d times, %d MiB" % (
 			TOTAL_FILES_REFORMATTED, TOTAL_BYTES_IN_FILES_REFORMATTED//0x100000), file=fd)
+	print_history_stats(fd)
+	blob_store.print_stats(fd)
 	git_repo.print_stats(fd)
 	return